@@ -1,8 +1,71 @@
 from datetime import datetime, timedelta, timezone
-import pytz
 from decimal import Decimal
 import sqlite3
 import pickle
+import atexit
+import weakref
+import threading
+import queue
+import time
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# The transaction history queries are composed once here so that the statement text, and therefore the sqlite3
+# statement cache key, is the same on every call. The columns are listed so rows can be unpacked by position.
+_SQL_TXN_COLUMNS = "SELECT id, account_number, type, created_at, amount"
+_SQL_SEL_TXN_IN = _SQL_TXN_COLUMNS + " FROM transactions WHERE account_number = ? AND type IN ('D', 'I') " \
+                  "AND created_at BETWEEN ? AND ? ORDER BY created_at DESC"
+_SQL_SEL_TXN_OUT = _SQL_TXN_COLUMNS + " FROM transactions WHERE account_number = ? AND type = 'W' " \
+                   "AND created_at BETWEEN ? AND ? ORDER BY created_at DESC"
+_SQL_SEL_TXN_FAILED = _SQL_TXN_COLUMNS + " FROM transactions WHERE account_number = ? AND type = 'X' " \
+                      "AND created_at BETWEEN ? AND ? ORDER BY created_at DESC"
+_SQL_SEL_TXN_ALL = _SQL_TXN_COLUMNS + " FROM transactions WHERE account_number = ? " \
+                   "AND created_at BETWEEN ? AND ? ORDER BY created_at DESC"
+_TXN_QUERIES = {"In": _SQL_SEL_TXN_IN,
+                "Out": _SQL_SEL_TXN_OUT,
+                "Failed": _SQL_SEL_TXN_FAILED,
+                "All": _SQL_SEL_TXN_ALL}
+# The time ranges, in days, the transaction history can be requested for
+TIME_RANGES = frozenset({7, 30, 90})
+
+# created_at is stored as an integer number of microseconds since the Unix epoch
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def to_epoch_us(moment):
+    # A naive datetime is taken to be in UTC, the time every transaction is stamped in
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - _EPOCH) // _MICROSECOND
+
+
+def from_epoch_us(epoch_us):
+    return _EPOCH + timedelta(microseconds=epoch_us)
+
+
+# main imports this module, so Account and ConfirmationNumber can't be imported at the top of it. They're imported the
+# first time an account is read or a row is converted and kept here, instead of running the import statement for every
+# call.
+_Account = None
+_ConfirmationNumber = None
+
+# Every DataBase created in this process, so the transactions still buffered in them can be written at exit even if
+# close() was never called. The set only holds weak references, it doesn't keep databases alive.
+_databases = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_databases():
+    # Each database is flushed on its own, one that fails is logged and doesn't keep the others from being written
+    for db in list(_databases):
+        try:
+            db.flush()
+        except Exception:
+            logger.exception("Failed to write the buffered transactions of %s at exit", db.db_file)
 
 
 class TableCreationError(Exception):
@@ -17,6 +80,17 @@ class DataInsertionError(Exception):
     """
 
 
+class RejectedTransactionsError(DataInsertionError):
+    """
+    Exception raised when the transactions table rejects some of the buffered transactions, which are dropped.
+    transaction_ids holds their ids.
+    """
+
+    def __init__(self, message, transaction_ids):
+        super().__init__(message)
+        self.transaction_ids = transaction_ids
+
+
 class DataRetrievalError(Exception):
     """
     Raised when there is an error retrieving data from a database or other data source.
@@ -27,74 +101,284 @@ class CustomerNotFound(Exception):
     pass
 
 
+class ConnectionPool:
+    """
+    A pool of read-only connections to a database, handed out one caller at a time.
+    """
+
+    def __init__(self, db_file, size=4):
+        self.db_file = db_file
+        # Resolved once, so a relative path keeps pointing at the same file if the working directory changes later
+        self._uri = f"{Path(db_file).resolve().as_uri()}?mode=ro"
+        self._idle = queue.Queue(maxsize=size)
+
+    def connect(self):
+        # Open the file read-only and refuse writes at the SQL level too. Reads go through a 256 MB memory map instead
+        # of read() calls.
+        conn = sqlite3.connect(self._uri, uri=True, detect_types=0, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA query_only=1")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    @contextmanager
+    def acquire(self):
+        # Reuse an idle connection, or open a new one if they are all in use. Connections that don't fit back in the
+        # pool are closed.
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self.connect()
+        try:
+            yield conn
+        finally:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
 class DataBase:
-    def __init__(self, db_file):
+    # The schema, one script per table with its indexes. Every statement is idempotent, so the scripts run each time a
+    # database is opened.
+    #
+    # customers.id is an alias for the rowid, so SQLite assigns it without the extra sqlite_sequence update
+    # AUTOINCREMENT costs. The id of the newest customer may be reused if they're deleted, customers are never deleted
+    # though. The national_number index speeds up searching for customers using that field.
+    _SQL_SCHEMA_CUST = '''CREATE TABLE IF NOT EXISTS customers
+                          (id INTEGER PRIMARY KEY,
+                           f_name TEXT,
+                           l_name TEXT,
+                           age INTEGER,
+                           gender TEXT,
+                           mobile_number TEXT,
+                           address TEXT,
+                           email_address TEXT,
+                           national_number TEXT NOT NULL);
+                          CREATE INDEX IF NOT EXISTS national_number_index ON customers (national_number);'''
+    # The customer_id index means counting a customer's accounts doesn't scan the table
+    _SQL_SCHEMA_ACCT = '''CREATE TABLE IF NOT EXISTS accounts
+                          (id INTEGER PRIMARY KEY,
+                           balance INTEGER,
+                           time_zone TEXT,
+                           customer_id INTEGER NOT NULL,
+                           legacy_blob BLOB,
+                           FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE);
+                          CREATE INDEX IF NOT EXISTS idx_accounts_customer ON accounts (customer_id);'''
+    _SQL_CREATE_TXN = '''CREATE TABLE IF NOT EXISTS transactions
+                         (id INTEGER PRIMARY KEY,
+                          account_number INTEGER NOT NULL,
+                          type TEXT,
+                          created_at INTEGER,
+                          amount INTEGER,
+                          FOREIGN KEY (account_number) REFERENCES accounts (id) ON DELETE SET NULL)'''
+    # The first index matches the history queries: they filter on account_number and a created_at range and sort by
+    # created_at, having type in the index as well lets SQLite answer them from the index. The second one is for the
+    # single type queries (Out, Failed), which can then range scan exactly the rows of that type instead of skipping
+    # over the others.
+    _SQL_SCHEMA_TXN = _SQL_CREATE_TXN + ''';
+                          CREATE INDEX IF NOT EXISTS idx_txn_acct_time
+                           ON transactions (account_number, created_at DESC, type);
+                          CREATE INDEX IF NOT EXISTS idx_txn_acct_type_time
+                           ON transactions (account_number, type, created_at DESC);'''
+    # metadata is only ever looked up by key, so the rows are stored in the primary key's B-tree directly instead of
+    # in a separate rowid table.
+    _SQL_SCHEMA_META = "CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;"
+    _SQL_INS_CUST = "INSERT INTO customers (f_name, l_name, age, gender, mobile_number, address, email_address, " \
+                    "national_number) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    # The insert for batches of customers. It skips customers that are already in the system, including ones inserted
+    # earlier in the same batch, like add_customer does.
+    _SQL_INS_CUSTS = "INSERT INTO customers (f_name, l_name, age, gender, mobile_number, address, email_address, " \
+                     "national_number) SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8 " \
+                     "WHERE NOT EXISTS (SELECT 1 FROM customers WHERE national_number = ?8)"
+    _SQL_INS_ACCT = "INSERT INTO accounts (id, balance, time_zone, customer_id) VALUES (?, ?, ?, ?)"
+    _SQL_INS_TXN = "INSERT INTO transactions (id, account_number, type, created_at, amount) VALUES (?, ?, ?, ?, ?)"
+    _SQL_COUNT_CUST_ACCTS = "SELECT COUNT(a.id) FROM customers c LEFT JOIN accounts a ON a.customer_id = c.id " \
+                            "WHERE c.national_number = ?"
+    _SQL_CUST_EXISTS = "SELECT 1 FROM customers WHERE national_number = ? LIMIT 1"
+    _SQL_SEL_META = "SELECT value FROM metadata WHERE key = ?"
+    _SQL_UPSERT_META = "INSERT INTO metadata (key, value) VALUES (?, ?) " \
+                       "ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+    # Reserve the next ?1 transaction ids and return the end of the block, in one statement so that two connections to
+    # the same file, in this process or another one, can never be given the same ids
+    _SQL_RESERVE_TXN_IDS = "INSERT INTO metadata (key, value) VALUES ('transaction_id', ?1) " \
+                           "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + ?1 RETURNING value"
+    # Give back the unused end of a block, unless someone reserved ids after it
+    _SQL_RELEASE_TXN_IDS = "UPDATE metadata SET value = ?1 WHERE key = 'transaction_id' AND CAST(value AS INTEGER) = ?2"
+
+    def __init__(self, db_file, batch_size=100, read_pool_size=4, flush_interval=1.0, rate_ttl=60.0):
         self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rate_ttl = rate_ttl
+        # A single connection does all the writing, serialized by the lock, while reads run on their own pooled
+        # connections so in WAL mode they don't wait for the writer or for each other.
+        self._conn = None
+        self._lock = threading.RLock()
+        # How many transaction() blocks are open and the thread running them. While one is, writes join its transaction
+        # instead of committing on their own, and that thread's reads go through the writer so they see its writes.
+        self._transaction_depth = 0
+        self._transaction_thread = None
+        self._read_pool = ConnectionPool(db_file, read_pool_size)
+        self._pending_transactions = []
+        self._pending_since = None
+        self._flush_timer = None
+        # The error of a timed flush that dropped rejected rows, raised by the next add_transaction or flush
+        self._timed_flush_error = None
+        # The next transaction id to hand out and the end of the block of ids reserved for this object
+        self._transaction_id = None
+        self._reserved_until = None
+        self._monthly_interest_rate = None
+        self._rate_fetched_at = None
+        _databases.add(self)
+
+    def _get_conn(self):
+        # Open the shared connection on first use and tune it once, every method reuses it afterwards instead of
+        # reconnecting per call.
+        with self._lock:
+            if self._conn is None:
+                conn = self.__class__.open_connection(self.db_file)
+                self.__class__.accounts_table_migration(conn)
+                self.__class__.transactions_table_migration(conn)
+                self._conn = conn
+
+                # Create the tables once, when the connection is opened, instead of probing sqlite_master before every
+                # insert. All the statements are idempotent.
+                self.init_schema()
+        return self._conn
+
+    def init_schema(self):
+        # Run all the table and index statements as a single script in one transaction, so opening a database costs
+        # one call and one commit instead of one per statement.
+        conn = self._get_conn()
+        with self._lock:
+            try:
+                conn.executescript(f"BEGIN IMMEDIATE; {self._SQL_SCHEMA_CUST} {self._SQL_SCHEMA_ACCT} "
+                                   f"{self._SQL_SCHEMA_TXN} {self._SQL_SCHEMA_META} COMMIT;")
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise TableCreationError(f"Failed to create table: {e}")
+
+    def _in_transaction(self):
+        return self._transaction_depth > 0 and self._transaction_thread == threading.get_ident()
+
+    @contextmanager
+    def _writing(self):
+        # The writer connection, with the lock held. The statements run in the block are committed when it ends, or
+        # rolled back if it raises. Inside a transaction() block they're put in a savepoint instead, so a failed write
+        # is still undone on its own while the rest is committed or rolled back with the transaction.
+        conn = self._get_conn()
+        with self._lock:
+            if not self._in_transaction():
+                with conn:
+                    yield conn
+                return
+
+            conn.execute("SAVEPOINT db_write")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK TO db_write")
+                conn.execute("RELEASE db_write")
+                raise
+            conn.execute("RELEASE db_write")
+
+    @contextmanager
+    def _reader(self):
+        # The writer creates the database file and its schema, make sure that happened before reading
+        if self._conn is None:
+            self._get_conn()
+        if self._in_transaction():
+            # The pooled connections can't see the uncommitted writes of the open transaction
+            with self._lock:
+                yield self._conn
+            return
+        with self._read_pool.acquire() as conn:
+            yield conn
+
+    def _execute_script(self, conn, script):
+        # executescript commits the open transaction before running the script, inside a transaction() block the
+        # statements are run one at a time instead. None of the schema statements contain a ';' of their own.
+        if not self._in_transaction():
+            conn.executescript(script)
+            return
+        for statement in script.split(';'):
+            if statement.strip():
+                conn.execute(statement)
+
+    @staticmethod
+    def open_connection(db_file):
+        # Only ints, strings, bytes and None are ever bound or read back, so no adapters or converters are involved
+        conn = sqlite3.connect(db_file, detect_types=0, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _discard_uncommitted(self):
+        # A transaction() block was rolled back, the transactions buffered and the ids reserved and rate saved in it
+        # were never written
+        self._clear_pending()
+        self._transaction_id = self._reserved_until = None
+        self._monthly_interest_rate = None
+
+    def close(self):
+        self.flush()
+        self._release_transaction_ids()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._read_pool.close()
 
     def create_customers_table(self):
-        with sqlite3.connect(self.db_file) as conn:
+        conn = self._get_conn()
+        with self._lock:
             try:
-                # Create the customers table
-                conn.execute('''CREATE TABLE IF NOT EXISTS customers
-                                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                  f_name TEXT,
-                                  l_name TEXT,
-                                  age INTEGER,
-                                  gender TEXT,
-                                  mobile_number TEXT,
-                                  address TEXT,
-                                  email_address TEXT,
-                                  national_number TEXT NOT NULL)''')
-
-                # create an index on the national_number field to improve the speed of searching for customers using
-                # this field.
-                conn.execute("CREATE INDEX national_number_index ON customers (national_number)")
-
-                # Save the changes
-                conn.commit()
+                # Create the customers table and its index
+                self._execute_script(conn, self._SQL_SCHEMA_CUST)
 
             except sqlite3.Error as e:
                 raise TableCreationError(f"Failed to create table: {e}")
 
     def add_customer(self, f_name, l_name, age, gender, mobile_number, address, email, national_number):
         # Insert a new customer into the customers table
-        with sqlite3.connect(self.db_file) as conn:
+        with self._writing() as conn:
             try:
                 # Check if the customer already exists in the database
-                if self.is_customer_in_the_system(conn):
+                if self._exists(self._SQL_CUST_EXISTS, (national_number,)):
                     return
 
-                # check if the customers table doesn't exist.
-                cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='customers'")
-                table_exists = cursor.fetchone() is not None
-                if not table_exists:
-                    # Create the customers table if it doesn't exist
-                    self.create_customers_table()
-
                 conn.execute(
-                    "INSERT INTO customers (f_name, l_name, age, gender, mobile_number, "
-                    "address, email_address, national_number) "
-                    "VALUES (:fn, :ln, :age, :gn, :mb, :addr, :em, :nn)",
-                    {'fn': f_name,
-                     'ln': l_name,
-                     'age': age,
-                     'gn': gender,
-                     'mb': mobile_number,
-                     'addr': address,
-                     'em': email,
-                     'nn': national_number})
-
-                # Save the changes
-                conn.commit()
+                    self._SQL_INS_CUST,
+                    (f_name, l_name, age, gender, mobile_number, address, email, national_number))
+
                 print(f"Customer {f_name} {l_name} has been successfully added to the system.")
 
             except sqlite3.Error as e:
                 raise DataInsertionError(f"Failed to insert data: {e}")
 
+    def add_customers(self, customers):
+        # Insert many customers in a single transaction. customers is an iterable of
+        # (f_name, l_name, age, gender, mobile_number, address, email, national_number) tuples.
+        with self._writing() as conn:
+            try:
+                cursor = conn.executemany(self._SQL_INS_CUSTS, customers)
+                print(f"{cursor.rowcount} customers have been successfully added to the system.")
+
+            except sqlite3.Error as e:
+                raise DataInsertionError(f"Failed to insert data: {e}")
+
     def get_customer_by_national_number(self, national_number):
-        with sqlite3.connect(self.db_file) as conn:
+        with self._reader() as conn:
             try:
-                cursor = conn.execute("SELECT * FROM customers WHERE national_number=:nn", {'nn': national_number})
+                cursor = conn.execute("SELECT * FROM customers WHERE national_number = ?", (national_number,))
                 customer = cursor.fetchone()
 
                 if customer is None:
@@ -116,13 +400,10 @@ class DataBase:
                 raise DataRetrievalError(f"Failed to retrieve data: {e}")
 
     def can_customer_have_another_account(self, national_number):
-        with sqlite3.connect(self.db_file) as conn:
+        with self._reader() as conn:
             try:
-                # Get the customer's ID
-                customer_id = self.get_customer_id(conn, national_number)
-
-                # Check how many accounts the customer has
-                cursor = conn.execute("SELECT COUNT(*) FROM accounts WHERE customer_id = ?", (customer_id,))
+                # Count the customer's accounts, looking the customer up by national number in the same query
+                cursor = conn.execute(self._SQL_COUNT_CUST_ACCTS, (national_number,))
                 num_accounts = cursor.fetchone()[0]
 
                 # Check if the customer can have another account
@@ -135,7 +416,7 @@ class DataBase:
                 raise DataRetrievalError(f"Failed to retrieve data: {e}")
 
     def is_customer_in_the_system(self, national_number):
-        with sqlite3.connect(self.db_file) as conn:
+        with self._reader() as conn:
             try:
                 cursor = conn.execute("SELECT id FROM customers WHERE national_number = ?", (national_number,))
                 customer = cursor.fetchone()
@@ -157,251 +438,455 @@ class DataBase:
             raise DataRetrievalError(f"Failed to retrieve data: {e}")
 
     def create_accounts_table(self):
-        with sqlite3.connect(self.db_file) as conn:
+        conn = self._get_conn()
+        with self._lock:
             try:
-                # Create the accounts table
-                conn.execute('''CREATE TABLE IF NOT EXISTS accounts
-                                 (id INTEGER PRIMARY KEY,
-                                  account_object BLOB,
-                                  customer_id INTEGER NOT NULL,
-                                  FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE)''')
-                # Save the changes
-                conn.commit()
+                # Create the accounts table and its index
+                self._execute_script(conn, self._SQL_SCHEMA_ACCT)
 
             except sqlite3.Error as e:
                 raise TableCreationError(f"Failed to create table: {e}")
 
     def add_account(self, account, customer_id):
         # Insert a new account into the accounts table
-        with sqlite3.connect(self.db_file) as conn:
+        with self._writing() as conn:
             try:
-                # check if the accounts table doesn't exist.
-                cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='accounts'")
-                table_exists = cursor.fetchone() is not None
-                if not table_exists:
-                    # Create the accounts table if it doesn't exist
-                    self.create_accounts_table()
-
+                # The balance is stored in cents, like the transactions amount
                 conn.execute(
-                    "INSERT INTO accounts (id, account_object, customer_id) VALUES (?, ?, ?)",
-                    (account.account_number, pickle.dumps(account), customer_id))
+                    self._SQL_INS_ACCT,
+                    (account.account_number, int(account.balance.scaleb(2)), str(account.time_zone), customer_id))
 
-                # Save the changes
-                conn.commit()
                 print(f"Account with account number {account.account_number} has been successfully added.")
 
             except sqlite3.Error as e:
                 raise DataInsertionError(f"Failed to insert data: {e}")
 
+    def add_accounts(self, accounts):
+        # Insert many accounts in a single transaction. accounts is an iterable of (account, customer_id) pairs.
+        with self._writing() as conn:
+            try:
+                cursor = conn.executemany(
+                    self._SQL_INS_ACCT,
+                    ((account.account_number, int(account.balance.scaleb(2)), str(account.time_zone), customer_id)
+                     for account, customer_id in accounts))
+
+                print(f"{cursor.rowcount} accounts have been successfully added.")
+
+            except sqlite3.Error as e:
+                raise DataInsertionError(f"Failed to insert data: {e}")
+
+    def get_account(self, account_number):
+        global _Account
+        if _Account is None:
+            from main import Account as _Account
+
+        with self._writing() as conn:
+            try:
+                cursor = conn.execute("SELECT balance, time_zone, legacy_blob FROM accounts WHERE id = ?",
+                                      (account_number,))
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+
+                balance, time_zone, legacy_blob = row
+                if balance is None:
+                    # The account was saved as a pickled object before the accounts table had columns for its
+                    # fields, convert it now so the blob is only ever unpickled once.
+                    legacy_account = pickle.loads(legacy_blob)
+                    balance = int(legacy_account.balance.scaleb(2))
+                    time_zone = str(legacy_account.time_zone)
+                    conn.execute("UPDATE accounts SET balance = ?, time_zone = ?, legacy_blob = NULL WHERE id = ?",
+                                 (balance, time_zone, account_number))
+
+                return _Account(f"{int(account_number):016d}", Decimal(balance).scaleb(-2), self, time_zone)
+
+            except sqlite3.Error as e:
+                raise DataRetrievalError(f"Failed to retrieve data: {e}")
+
     def create_transactions_table(self):
-        with sqlite3.connect(self.db_file) as conn:
+        conn = self._get_conn()
+        with self._lock:
             try:
-                # Create the transactions table, if it exists do nothing.
-                conn.execute('''CREATE TABLE IF NOT EXISTS transactions
-                                 (id INTEGER PRIMARY KEY,
-                                  account_number TEXT NOT NULL,
-                                  type TEXT,
-                                  created_at TIMESTAMP,
-                                  amount INTEGER,
-                                  FOREIGN KEY (account_number) REFERENCES accounts (id) ON DELETE SET NULL)''')
-                # Save the changes
-                conn.commit()
+                # Create the transactions table and its indexes, if they exist do nothing.
+                self._execute_script(conn, self._SQL_SCHEMA_TXN)
 
             except sqlite3.Error as e:
                 raise TableCreationError(f"Failed to create table: {e}")
 
     def add_transaction(self, confirmation_number):
-        # Insert a new transaction into the transactions table
-        with sqlite3.connect(self.db_file) as conn:
+        # Buffer the transaction, it's inserted together with the rest of the batch once the buffer is full or has been
+        # waiting for flush_interval seconds, before transactions are read back, or when the database is closed.
+        with self._lock:
+            pending = self._pending_transactions
+            now = time.monotonic()
+            if not pending:
+                self._pending_since = now
+                self._start_flush_timer()
+            pending.append(confirmation_number)
+            if len(pending) >= self.batch_size or now - self._pending_since >= self.flush_interval:
+                self.flush()
+            else:
+                self._raise_timed_flush_error()
+
+    def _start_flush_timer(self):
+        # The age of the buffer is also checked when a row is added, the timer covers the last transaction of a burst,
+        # which would otherwise wait for the next write. It runs on a daemon thread so it doesn't hold up exit,
+        # _flush_databases writes whatever is left then.
+        timer = threading.Timer(self.flush_interval, self._timed_flush)
+        timer.daemon = True
+        self._flush_timer = timer
+        timer.start()
+
+    def _timed_flush(self):
+        with self._lock:
             try:
-                # check if the transactions table doesn't exist.
-                cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='transactions'")
-                table_exists = cursor.fetchone() is not None
-                if not table_exists:
-                    # Create the transactions table if it doesn't exist
-                    self.create_transactions_table()
-
-                conn.execute(
-                    "INSERT INTO transactions (id, account_number, type, created_at, amount) VALUES (:id, "
-                    ":an, :type, :time, :amt)",
-                    {'id': confirmation_number.transaction_id,
-                     'an': str(confirmation_number.account_number),
-                     'type': confirmation_number.transaction_type,
-                     'time': confirmation_number.transaction_time,
-                     'amt': int(confirmation_number.amount*100)})
-                # Save the changes
-                conn.commit()
+                self.flush()
+            except RejectedTransactionsError as e:
+                # The rejected rows are already dropped, there's no caller on the timer thread to tell. The error is
+                # logged and kept so the next add_transaction or flush raises it.
+                logger.error("Timed flush of %s dropped transactions: %s", self.db_file, e)
+                self._timed_flush_error = e
+            except DataInsertionError as e:
+                # The batch is kept, the next add_transaction or flush retries it and raises the error if it fails
+                # again
+                logger.warning("Timed flush of %s failed, the batch is kept: %s", self.db_file, e)
+
+    def _raise_timed_flush_error(self):
+        error = self._timed_flush_error
+        if error is not None:
+            self._timed_flush_error = None
+            raise error
+
+    def add_transactions(self, confirmation_numbers):
+        # Insert many transactions into the transactions table in a single transaction. confirmation_numbers can be any
+        # iterable, rows are encoded one at a time as executemany consumes them, so a long replay is never held in
+        # memory as a whole.
+        with self._writing() as conn:
+            try:
+                conn.executemany(self._SQL_INS_TXN, self.__class__.transaction_rows(confirmation_numbers))
 
             except sqlite3.Error as e:
                 raise DataInsertionError(f"Failed to insert data: {e}")
 
+    @staticmethod
+    def transaction_rows(confirmation_numbers):
+        # The column values of each transaction, in the order _SQL_INS_TXN binds them
+        return ((cn.transaction_id, cn.account_number, cn.transaction_type, cn.transaction_time_us, cn.amount_cents)
+                for cn in confirmation_numbers)
+
+    def flush(self):
+        # Write the buffered transactions in one database transaction, so a batch costs a single commit. Nothing is
+        # cleared if the write fails, so it's retried, unless the table rejected some of the rows.
+        with self._lock:
+            pending = self._pending_transactions
+            if pending:
+                try:
+                    with self._writing() as conn:
+                        conn.executemany(self._SQL_INS_TXN, self.__class__.transaction_rows(pending))
+
+                except sqlite3.IntegrityError as e:
+                    # A row the table rejects would fail every retry of the batch and with it every later write, so
+                    # the rows are written one at a time instead and the rejected ones are dropped
+                    rejected = self._insert_transactions_one_by_one(pending)
+                    self._clear_pending()
+                    raise RejectedTransactionsError(f"Failed to insert transactions {rejected}: {e}", rejected)
+
+                except sqlite3.Error as e:
+                    raise DataInsertionError(f"Failed to insert data: {e}")
+
+                self._clear_pending()
+
+            # Rows a timed flush dropped are reported to this caller
+            self._raise_timed_flush_error()
+
+    def _insert_transactions_one_by_one(self, confirmation_numbers):
+        # Returns the ids of the transactions that couldn't be inserted
+        rejected = []
+        with self._writing() as conn:
+            for row in self.__class__.transaction_rows(confirmation_numbers):
+                try:
+                    conn.execute(self._SQL_INS_TXN, row)
+                except sqlite3.IntegrityError:
+                    rejected.append(row[0])
+        return rejected
+
+    def _clear_pending(self):
+        self._pending_transactions.clear()
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
     @staticmethod
     def get_confirmation_number_from_row(row):
-        from main import ConfirmationNumber
+        global _ConfirmationNumber
+        if _ConfirmationNumber is None:
+            from main import ConfirmationNumber as _ConfirmationNumber
 
         if row is None:
             return None
 
-        # Otherwise, reconstruct the ConfirmationNumber object and return it
-        transaction_id, account_number, transaction_type, transaction_time, amount = row
-        confirmation_number = ConfirmationNumber(transaction_type, account_number,
-                                                 datetime.fromisoformat(transaction_time), transaction_id, amount)
+        # Otherwise, reconstruct the ConfirmationNumber object and return it, account numbers are stored as integers
+        # so the leading zeros of the 16-digit number are restored.
+        transaction_id, account_number, transaction_type, created_at, amount = row
+        confirmation_number = _ConfirmationNumber._from_cents(transaction_type, f"{account_number:016d}", created_at,
+                                                              transaction_id, amount)
         return confirmation_number
 
     def get_transactions_by_type(self, account_number, transaction_type='All', time_range=7):
-        with sqlite3.connect(self.db_file) as conn:
-            # Check the time range argument
-            if time_range == 7:
-                days = 7
-            elif time_range == 30:
-                days = 30
-            elif time_range == 90:
-                days = 90
-            else:
-                raise ValueError('Invalid time range')
-
-            # Calculate the time window
-            end_date = datetime.now(tz=pytz.utc)
-            start_date = end_date - timedelta(days=days)
-
-            # Build the SQL query based on the transaction_type parameter
-            if transaction_type == "In":
-                query = "SELECT * FROM transactions WHERE account_number = ? AND type IN ('D', 'I')"
-            elif transaction_type == "Out":
-                query = "SELECT * FROM transactions WHERE account_number = ? AND type = 'W'"
-            elif transaction_type == "Failed":
-                query = "SELECT * FROM transactions WHERE account_number = ? AND type = 'X'"
-            elif transaction_type == "All":
-                query = "SELECT * FROM transactions WHERE account_number = ?"
-            else:
-                raise ValueError("Invalid transaction_type")
+        # Make the buffered transactions visible to the query
+        self.flush()
 
-            # Add a WHERE clause to the query to filter transactions within the date range
-            query += " AND created_at BETWEEN ? AND ?"
+        # Check the time range argument
+        if time_range not in TIME_RANGES:
+            raise ValueError('Invalid time range')
 
-            # Add an ORDER BY clause to the query to sort transactions by date in descending order
-            query += " ORDER BY created_at DESC"
+        # Calculate the time window
+        end_date = datetime.now(tz=timezone.utc)
+        start_date = end_date - timedelta(days=time_range)
 
-            try:
-                # Execute the SQL query
-                cursor = conn.execute(query, (str(account_number), start_date, end_date))
-            except sqlite3.Error as e:
-                raise DataRetrievalError(f"Failed to retrieve data: {e}")
+        # Pick the SQL query based on the transaction_type parameter
+        try:
+            query = _TXN_QUERIES[transaction_type]
+        except KeyError:
+            raise ValueError("Invalid transaction_type")
+
+        params = (account_number, to_epoch_us(start_date), to_epoch_us(end_date))
+        if self._in_transaction():
+            # Inside a transaction() block the query runs on the writer, with the writer lock held. The rows are all
+            # fetched before the lock is released, so a history that's only partly read can't keep the lock after the
+            # block ends.
+            with self._reader() as conn:
+                rows = self.__class__._select_history(conn, query, params).fetchall()
+            for row in rows:
+                yield self.get_confirmation_number_from_row(row)
+            return
+
+        # The read connection is held for the generator's lifetime and goes back to the pool once it's exhausted or
+        # closed.
+        with self._reader() as conn:
+            cursor = self.__class__._select_history(conn, query, params)
 
-            # Yield ConfirmationNumber objects from the query results
-            for row in cursor.fetchall():
+            # Yield ConfirmationNumber objects while stepping through the cursor, so rows are fetched lazily instead
+            # of materializing the whole result first.
+            for row in cursor:
                 yield self.get_confirmation_number_from_row(row)
 
-    def load_transaction_id(self):
-        with sqlite3.connect(self.db_file) as conn:
-            try:
-                # Check if the metadata table exists, and create it if not.
-                self.__class__.metadata_table_check(conn)
+    @staticmethod
+    def _select_history(conn, query, params):
+        try:
+            # Execute the SQL query. Rows are plain tuples, and are fetched from SQLite 256 at a time when the cursor
+            # is iterated.
+            cursor = conn.cursor()
+            cursor.arraysize = 256
+            cursor.execute(query, params)
+            return cursor
+        except sqlite3.Error as e:
+            raise DataRetrievalError(f"Failed to retrieve data: {e}")
 
-                # Retrieve the current value of the transaction_id from the database
-                cursor = conn.execute("SELECT value FROM metadata WHERE key = 'transaction_id'")
-                row = cursor.fetchone()
-                if row is not None:
-                    # Return the retrieved value as an integer
-                    return int(row[0])
-                else:
-                    # if the transaction_id hasn't been saved to the database yet, the value of transaction_id will
-                    # start from 0 and increase after each transaction.
-                    self.save_transaction_id(0)
-                    return 0
+    def _exists(self, sql, params):
+        # Run a SELECT 1 ... LIMIT 1 query and tell whether it matched a row, without reading any columns. Inside a
+        # transaction() block _reader goes through the writer, so rows written earlier in the block are found too.
+        with self._reader() as conn:
+            try:
+                return conn.execute(sql, params).fetchone() is not None
+            except sqlite3.Error as e:
+                raise DataRetrievalError(f"Failed to retrieve data: {e}")
 
+    def _get_meta(self, key):
+        # Retrieve the value saved under key in the metadata table, None if it hasn't been saved yet
+        with self._reader() as conn:
+            try:
+                row = conn.execute(self._SQL_SEL_META, (key,)).fetchone()
             except sqlite3.Error as e:
                 raise DataRetrievalError(f"Failed to retrieve data: {e}")
+        return None if row is None else row[0]
 
-    def save_transaction_id(self, transaction_id):
-        with sqlite3.connect(self.db_file) as conn:
+    def _set_meta(self, key, value):
+        with self._writing() as conn:
             try:
-                # Check if the metadata table exists, and create it if not.
-                self.__class__.metadata_table_check(conn)
+                # Insert the value, or update it if the key already exists, in a single statement
+                conn.execute(self._SQL_UPSERT_META, (key, str(value)))
+            except sqlite3.Error as e:
+                raise DataInsertionError(f"Failed to insert data: {e}")
 
-                # Check if a row with key='transaction_id' already exists
-                cursor = conn.execute("SELECT value FROM metadata WHERE key = 'transaction_id'")
-                row = cursor.fetchone()
-                if row is not None:
-                    # Update the value of the transaction_id in the database
-                    conn.execute("UPDATE metadata SET value = ? WHERE key = 'transaction_id'", (str(transaction_id),))
-                else:
-                    # Insert the initial value of the transaction_id into the database
-                    conn.execute("INSERT INTO metadata (key, value) VALUES ('transaction_id', ?)",
-                                 (str(transaction_id),))
-                # Save the changes
-                conn.commit()
+    def load_transaction_id(self):
+        # The next transaction id that will be handed out
+        with self._lock:
+            if self._transaction_id is not None:
+                return self._transaction_id
+            value = self._get_meta('transaction_id')
+            return 0 if value is None else int(value)
 
+    def save_transaction_id(self, transaction_id):
+        # Set the next free transaction id, the ids left in this object's block are dropped
+        with self._lock:
+            self._set_meta('transaction_id', transaction_id)
+            self._transaction_id = self._reserved_until = None
+
+    def next_transaction_id(self):
+        # Hand out transaction ids from a block reserved in the database, so it's only written once per block instead
+        # of on every transaction. Ids left unused in a block when the process exits are skipped, close() gives them
+        # back if no other connection has reserved ids since.
+        with self._lock:
+            if self._transaction_id is None or self._transaction_id >= self._reserved_until:
+                self._reserve_transaction_ids()
+            transaction_id = self._transaction_id
+            self._transaction_id = transaction_id + 1
+            return transaction_id
+
+    def _reserve_transaction_ids(self):
+        size = max(self.batch_size, 1)
+        with self._writing() as conn:
+            try:
+                reserved_until = int(conn.execute(self._SQL_RESERVE_TXN_IDS, (size,)).fetchone()[0])
             except sqlite3.Error as e:
                 raise DataInsertionError(f"Failed to insert data: {e}")
+        self._transaction_id = reserved_until - size
+        self._reserved_until = reserved_until
+
+    def _release_transaction_ids(self):
+        with self._lock:
+            if self._transaction_id is None or self._transaction_id >= self._reserved_until:
+                return
+            with self._writing() as conn:
+                try:
+                    conn.execute(self._SQL_RELEASE_TXN_IDS, (str(self._transaction_id), self._reserved_until))
+                except sqlite3.Error as e:
+                    raise DataInsertionError(f"Failed to insert data: {e}")
+            self._transaction_id = self._reserved_until = None
 
     def load_monthly_interest_rate(self):
-        with sqlite3.connect(self.db_file) as conn:
-            try:
-                # Check if the metadata table exists, and create it if not.
-                self.__class__.metadata_table_check(conn)
-
-                # Retrieve the current value of the monthly_interest_rate from the database
-                cursor = conn.execute("SELECT value FROM metadata WHERE key = 'monthly_interest_rate'")
-                row = cursor.fetchone()
-                if row is not None:
-                    # Return the retrieved value as a Decimal
-                    return Decimal(row[0])
-                else:
-                    # if the monthly_interest_rate hasn't been saved to the database yet, set it to a default value
-                    # of 0.05
-                    self.save_monthly_interest_rate('0.05')
-                    return Decimal('0.05')
-
-            except sqlite3.Error as e:
-                raise DataRetrievalError(f"Failed to retrieve data: {e}")
+        # The value is kept in memory and only read from the database again once it's rate_ttl seconds old, so a rate
+        # changed by another process is picked up without a query per call. save_monthly_interest_rate updates it
+        # right away.
+        now = time.monotonic()
+        if self._monthly_interest_rate is None or now - self._rate_fetched_at >= self.rate_ttl:
+            value = self._get_meta('monthly_interest_rate')
+            if value is None:
+                # if the monthly_interest_rate hasn't been saved to the database yet, set it to a default value of 0.05
+                self.save_monthly_interest_rate('0.05')
+            else:
+                self._monthly_interest_rate = Decimal(value)
+                self._rate_fetched_at = now
+        return self._monthly_interest_rate
 
     def save_monthly_interest_rate(self, monthly_interest_rate):
-        with sqlite3.connect(self.db_file) as conn:
-            try:
-                # Check if the metadata table exists, and create it if not.
-                self.__class__.metadata_table_check(conn)
+        self._set_meta('monthly_interest_rate', monthly_interest_rate)
+        self._monthly_interest_rate = Decimal(monthly_interest_rate)
+        self._rate_fetched_at = time.monotonic()
 
-                # Check if a row with key='monthly_interest_rate' already exists
-                cursor = conn.execute("SELECT value FROM metadata WHERE key = 'monthly_interest_rate'")
-                row = cursor.fetchone()
-                if row is not None:
-                    # Update the value of the monthly_interest_rate in the database
-                    conn.execute("UPDATE metadata SET value = ? WHERE key = 'monthly_interest_rate'",
-                                 (str(monthly_interest_rate),))
-                else:
-                    # Insert the initial value of the monthly_interest_rate into the database
-                    conn.execute("INSERT INTO metadata (key, value) VALUES ('monthly_interest_rate', ?)",
-                                 (str(monthly_interest_rate),))
-                # Save the changes
+    @staticmethod
+    def accounts_table_migration(conn):
+        # Accounts used to be stored as a pickled object in the account_object column, keep those rows in
+        # legacy_blob and add the columns the account fields are stored in now. get_account converts them on read.
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(accounts)")]
+        if 'account_object' in columns:
+            # An explicit transaction, sqlite3 would commit each of the ALTER statements on its own
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("ALTER TABLE accounts RENAME COLUMN account_object TO legacy_blob")
+                conn.execute("ALTER TABLE accounts ADD COLUMN balance INTEGER")
+                conn.execute("ALTER TABLE accounts ADD COLUMN time_zone TEXT")
                 conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    @classmethod
+    def transactions_table_migration(cls, conn):
+        # account_number used to be stored as text and created_at as ISO text, rebuild the table with the integer
+        # columns and convert the old values, created_at to microseconds since the epoch. A rebuild interrupted before
+        # it ran in a single transaction could have left the old rows in transactions_legacy, those are finished too.
+        columns = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(transactions)")}
+        needs_rebuild = columns.get('account_number') == 'TEXT' or columns.get('created_at') == 'TIMESTAMP'
+        stranded = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transactions_legacy'")
+        if not needs_rebuild and stranded.fetchone() is None:
+            return
+
+        # sqlite3 doesn't open a transaction before DDL statements on its own, without an explicit one the rename and
+        # the create would be committed straight away
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if needs_rebuild:
+                conn.execute("ALTER TABLE transactions RENAME TO transactions_legacy")
+            conn.execute(cls._SQL_CREATE_TXN)
+            rows = conn.execute("SELECT id, account_number, type, created_at, amount FROM transactions_legacy")
+            conn.executemany(cls._SQL_INS_TXN,
+                             ((transaction_id, int(account_number), transaction_type,
+                               cls.legacy_created_at_to_epoch_us(created_at), amount)
+                              for transaction_id, account_number, transaction_type, created_at, amount in rows))
+            conn.execute("DROP TABLE transactions_legacy")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
 
-            except sqlite3.Error as e:
-                raise DataInsertionError(f"Failed to insert data: {e}")
+    @staticmethod
+    def legacy_created_at_to_epoch_us(created_at):
+        # Old rows hold the ISO text of an aware UTC datetime, converted in Python so the microseconds are kept exactly
+        if not isinstance(created_at, str):
+            return created_at
+        return to_epoch_us(datetime.fromisoformat(created_at))
 
     @staticmethod
     def metadata_table_check(conn):
-        # Check if the metadata table exists
-        cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='metadata'")
-        table_exists = cursor.fetchone() is not None
-        if not table_exists:
-            # Create the metadata table if it doesn't exist
-            conn.execute("CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)")
-            # Save the changes
+        # Create the metadata table if it doesn't exist
+        conn.executescript(DataBase._SQL_SCHEMA_META)
+
+
+@contextmanager
+def transaction(db):
+    # Run the block as one write transaction on the database's long-lived writer connection. The writer lock is held
+    # until the block ends so its statements don't interleave with other writers, and BEGIN IMMEDIATE takes SQLite's
+    # write lock up front instead of failing halfway through the block. The DataBase methods called in the block join
+    # the transaction instead of committing, a block nested in another one is a savepoint of the outer transaction.
+    # The connection stays open afterwards, DataBase.close() closes it at shutdown.
+    #
+    # Transactions buffered before a block are written before it starts and the ones buffered in it before it ends, so
+    # rolling the block back never loses the former and always takes the latter with it.
+    conn = db._get_conn()
+    with db._lock:
+        if db._in_transaction():
+            db.flush()
+            db._transaction_depth += 1
+            try:
+                with db._writing():
+                    yield conn
+                    db.flush()
+            except BaseException:
+                db._discard_uncommitted()
+                raise
+            finally:
+                db._transaction_depth -= 1
+            return
+
+        db.flush()
+        conn.execute("BEGIN IMMEDIATE")
+        db._transaction_depth = 1
+        db._transaction_thread = threading.get_ident()
+        try:
+            yield conn
+            # Write the buffered transactions before committing
+            db.flush()
             conn.commit()
+        except BaseException:
+            conn.rollback()
+            db._discard_uncommitted()
+            raise
+        finally:
+            db._transaction_depth = 0
+            db._transaction_thread = None
 
 
 class DataBaseContextManager:
+    # Kept for existing callers, it's the same as `with transaction(db) as conn:`
     def __init__(self, db):
         self.db = db
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db.db_file)
+        self._transaction = transaction(self.db)
+        self.conn = self._transaction.__enter__()
         return self.conn
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type or exc_val or exc_tb:
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-        self.conn.close()
+        return self._transaction.__exit__(exc_type, exc_val, exc_tb)
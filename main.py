@@ -1,19 +1,79 @@
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta
 from decimal import Decimal, InvalidOperation, getcontext
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import compress
+import logging
 import secrets
-import pickle
-import pytz
-from database import DataBase
+import time
+from zoneinfo import ZoneInfo
+from database import DataBase, to_epoch_us, from_epoch_us, TIME_RANGES
 import re
 
 
 # getcontext().prec = 2
 
+# Transactions are reported at DEBUG level, so unless it's enabled the messages are never formatted or written. The
+# balance passed to them is a Decimal built from the cents, so the calls are also skipped when DEBUG is off.
+logger = logging.getLogger(__name__)
+
+# Every amount is kept to the cent. Parsing the quantizer once here saves building it again on every operation.
+_CENT = Decimal('.01')
+_ZERO = Decimal('0.00')
+# The highest monthly interest rate that can be set, 40%
+_MAX_RATE = Decimal('0.4')
+_HUNDRED = Decimal(100)
+_INVALID_AMOUNT_ERRORS = (InvalidOperation, TypeError, ValueError)
+# Whole amounts below this keep all their digits plus the two decimal places within the default Decimal precision of 28
+_MAX_EXACT_INT = 10 ** 26
+
+
+def _quantize_amount(amount):
+    """Convert amount to a Decimal rounded to the cent, raises one of _INVALID_AMOUNT_ERRORS if it isn't a number."""
+    if isinstance(amount, Decimal):
+        # Already a Decimal, no need to copy it into a new one before rounding
+        return amount.quantize(_CENT)
+    return Decimal(amount).quantize(_CENT)
+
+
+def _type_mask(codes):
+    """A bytes.translate table mapping each of the transaction type codes to 1 and every other byte to 0."""
+    return bytes(code in codes for code in range(256))
+
+
+# The type mask of each transaction history filter, built once here, None matches every type
+_HISTORY_TYPES = {'In': _type_mask(b'DI'), 'Out': _type_mask(b'W'), 'Failed': _type_mask(b'X'), 'All': None}
+_MICROSECONDS_PER_DAY = 86_400_000_000
+# Compiled once instead of on every validate_input call
+_EMAIL_RE = re.compile(r"[^@]+@[^@]+\.[^@]+")
+
+
+def _now_us():
+    """The current time in microseconds since the epoch, without building a datetime for it."""
+    return time.time_ns() // 1000
+
+
+def _restore_slots(obj, state):
+    """Set the attributes pickled for obj, whether they were saved before or after its class had __slots__."""
+    if isinstance(state, tuple):
+        # Pickled with __slots__, the state is (None, {slot: value})
+        state = state[1]
+    for name, value in state.items():
+        setattr(obj, name, value)
+
+
+def _apply_rate(cents, numerator, denominator):
+    """Multiply an amount in cents by the rate numerator/denominator, rounding half to even to the nearest cent."""
+    quotient, remainder = divmod(cents * numerator, denominator)
+    if remainder * 2 > denominator or (remainder * 2 == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
 
 def generate_account_number():
     """Generate a 16-digit account number."""
-    alphabet = "0123456789"
-    return "".join(secrets.choice(alphabet) for _ in range(16))
+    # One random draw below 10**16, zero-padded, is the same as picking each of the 16 digits at random
+    return f"{secrets.randbelow(10 ** 16):016d}"
 
 
 # the purpose of the gui is more user friendly look than the console. it is for the customers yes. the gui firstly
@@ -42,13 +102,37 @@ class AccountLimitExceededError(Exception):
 
 
 class ConfirmationNumber:
-    def __init__(self, transaction_type, account_number, transaction_time, transaction_id, amount=Decimal('0.00')):
+    # One of these is kept for every transaction, __slots__ saves a __dict__ per instance
+    __slots__ = ('_transaction_type', '_account_number', '_transaction_time', '_transaction_id', '_amount',
+                 '_time_zone', '_fmt_time')
+
+    def __init__(self, transaction_type, account_number, transaction_time, transaction_id, amount=_ZERO):
         self._transaction_type = transaction_type
         self._account_number = account_number
+        # The time is kept in microseconds since the epoch, the datetime is only built when it's asked for. It can be
+        # passed in either way.
+        if isinstance(transaction_time, datetime):
+            transaction_time = to_epoch_us(transaction_time)
         self._transaction_time = transaction_time
         self._transaction_id = transaction_id
-        self._amount = amount
+        # Like the account balance, the amount is kept as an int number of cents
+        self._amount = int(_quantize_amount(amount).scaleb(2))
         self._time_zone = None
+        self._fmt_time = None
+
+    @classmethod
+    def _from_cents(cls, transaction_type, account_number, transaction_time_us, transaction_id, amount_cents):
+        # Build one straight from the stored form of its time and amount, without converting them, for transactions
+        # made by an Account or read back from the database
+        confirmation_number = cls.__new__(cls)
+        confirmation_number._transaction_type = transaction_type
+        confirmation_number._account_number = account_number
+        confirmation_number._transaction_time = transaction_time_us
+        confirmation_number._transaction_id = transaction_id
+        confirmation_number._amount = amount_cents
+        confirmation_number._time_zone = None
+        confirmation_number._fmt_time = None
+        return confirmation_number
 
     @property
     def account_number(self):
@@ -64,59 +148,94 @@ class ConfirmationNumber:
 
     @property
     def transaction_time_utc(self):
-        return self._transaction_time.isoformat()
+        return self.transaction_time.isoformat()
 
     @property
     def transaction_time(self):
+        return from_epoch_us(self._transaction_time)
+
+    @property
+    def transaction_time_us(self):
         return self._transaction_time
 
     @property
     def transaction_time_local(self):
         if self._time_zone is None:
             raise AttributeError('This method exists to help other methods in other classes, can not work on its own')
-        return self._transaction_time.astimezone(self._time_zone).strftime('%Y-%m-%d %H:%M:%S (%Z%z)')
+        return self.transaction_time.astimezone(self._time_zone).strftime('%Y-%m-%d %H:%M:%S (%Z%z)')
 
     @property
     def amount(self):
-        return self._amount
+        return Decimal(self._amount).scaleb(-2)
 
     @amount.setter
     def amount(self, value):
-        self._amount = Decimal(value).quantize(Decimal('.01'))
+        self._amount = int(_quantize_amount(value).scaleb(2))
+
+    @property
+    def amount_cents(self):
+        return self._amount
+
+    def __reduce__(self):
+        # Pickle as a constructor call instead of slot by slot, the time zone is only set on localized ones
+        args = (self._transaction_type, self._account_number, self._transaction_time, self._transaction_id,
+                self._amount)
+        if self._time_zone is None:
+            return type(self)._from_cents, args
+        return type(self)._from_cents, args, {'_time_zone': self._time_zone}
+
+    def __setstate__(self, state):
+        # Accounts stored before the accounts table had columns were pickled along with their confirmation numbers,
+        # back then the time was kept as a datetime and the amount as a Decimal
+        self._fmt_time = None
+        _restore_slots(self, state)
+        if isinstance(self._transaction_time, datetime):
+            self._transaction_time = to_epoch_us(self._transaction_time)
+        if isinstance(self._amount, Decimal):
+            self._amount = int(self._amount.scaleb(2))
 
     def __str__(self):
-        formatted_time = self._transaction_time.strftime("%Y%m%d%H%M%S")
-        return f"{self._transaction_type}-{self._account_number}-{formatted_time}-" \
-               f"{str(self._transaction_id)}-({self.amount})"
+        # The time never changes, so it's only formatted the first time the confirmation number is shown
+        fmt_time = self._fmt_time
+        if fmt_time is None:
+            fmt_time = self._fmt_time = f"{self.transaction_time:%Y%m%d%H%M%S}"
+        return f"{self._transaction_type}-{self._account_number}-{fmt_time}-{self._transaction_id}-({self.amount})"
 
     def __repr__(self):
-        return f"ConfirmationNumber({self._transaction_type}, {self._account_number}, {self._transaction_time}," \
+        return f"ConfirmationNumber({self._transaction_type}, {self._account_number}, {self.transaction_time}," \
                f" {self._transaction_id}, {self.amount})"
 
 
 class Account:
+    __slots__ = ('_account_number', '_time_zone', '_db', '_balance', '_tx_ids', '_tx_types', '_tx_times', '_tx_amounts',
+                 '_tx_in_order')
     monthly_interest_rate = Decimal('0.05')
     transaction_id = None
+    # The transaction type codes are the same for every account, so they're class attributes instead of being stored
+    # on each instance. In the transactions arrays they're kept as their single byte.
+    _deposit_type = 'D'
+    _interest_deposit_type = 'I'
+    _withdrawal_type = 'W'
+    _declined_transaction_type = 'X'
 
     def __init__(self, account_number, balance, db: DataBase, time_zone='Africa/Cairo'):
         self._account_number = account_number
-        self._time_zone = pytz.timezone(time_zone)
+        # ZoneInfo keeps a cache of the zones it has loaded, so accounts in the same zone share one object
+        self._time_zone = ZoneInfo(time_zone)
         self._db = db
-        if not self.is_amount_a_number(balance):
+        try:
+            balance = _quantize_amount(balance)
+        except _INVALID_AMOUNT_ERRORS:
             raise ValueError("Invalid balance: balance must be a number or a string representing a number")
 
-        balance = Decimal(balance).quantize(Decimal('.01'))
-
         if balance < 0:
             raise ValueError("Invalid balance: balance must be a non-negative number")
 
-        self._balance = balance
+        # The balance is kept as an int number of cents, so updating it is plain int arithmetic. It's only turned back
+        # into a Decimal when it's read.
+        self._balance = int(balance.scaleb(2))
 
-        self._transactions = []
-        self._deposit_type = 'D'
-        self._interest_deposit_type = 'I'
-        self._withdrawal_type = 'W'
-        self._declined_transaction_type = 'X'
+        self._clear_transactions()
 
     @property
     def account_number(self):
@@ -124,7 +243,7 @@ class Account:
 
     @property
     def balance(self):
-        return self._balance
+        return Decimal(self._balance).scaleb(-2)
 
     @property
     def db(self):
@@ -135,106 +254,209 @@ class Account:
         return self._time_zone
 
     def deposit(self, amount):
-        confirmation_number = ConfirmationNumber(transaction_type=self._deposit_type,
-                                                 account_number=self._account_number,
-                                                 transaction_time=datetime.now(tz=pytz.utc),
-                                                 transaction_id=self._db.load_transaction_id())
-        self._db.save_transaction_id(confirmation_number.transaction_id + 1)
+        confirmation_number = self._new_confirmation(self._deposit_type)
 
-        if not self.is_amount_a_number(amount):
+        try:
+            amount = _quantize_amount(amount)
+        except _INVALID_AMOUNT_ERRORS:
             self._transaction_failure(confirmation_number)
             raise TransactionDeclinedError("Invalid amount: amount must be a number or a string representing a number")
 
-        amount = Decimal(amount).quantize(Decimal('.01'))
-
         if amount < 0:
-            amount = Decimal('0.00')
+            amount = _ZERO
 
-        confirmation_number.amount = amount
+        cents = int(amount.scaleb(2))
+        confirmation_number._amount = cents
 
-        self._balance += amount
-        print(f"Deposited {amount}. New balance is {self._balance}")
-        self._transactions.append(confirmation_number)
-        self._db.add_transaction(confirmation_number)
+        self._balance += cents
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Deposited %s. New balance is %s", amount, self.balance)
+        self._record_transaction(confirmation_number)
         return confirmation_number
 
     def apply_interest(self):
-        confirmation_number = ConfirmationNumber(transaction_type=self._interest_deposit_type,
-                                                 account_number=self._account_number,
-                                                 transaction_time=datetime.now(tz=pytz.utc),
-                                                 transaction_id=self._db.load_transaction_id())
-        self._db.save_transaction_id(confirmation_number.transaction_id + 1)
-
-        interest = (self._balance * self._db.load_monthly_interest_rate()).quantize(Decimal('.01'))
-        self._balance += interest
-
-        confirmation_number.amount = interest
-        print(f"Applied {self.monthly_interest_rate * 100}% interest. New balance is {self._balance}")
-        self._transactions.append(confirmation_number)
-        self._db.add_transaction(confirmation_number)
+        return self._pay_interest(*self._db.load_monthly_interest_rate().as_integer_ratio())
+
+    @staticmethod
+    def apply_interest_batch(accounts):
+        # Apply the monthly interest to many accounts at once, e.g. at the end of the month. Each database's rate is
+        # read and turned into an integer ratio once for the whole batch instead of once per account.
+        ratios = {}
+        confirmation_numbers = []
+        append = confirmation_numbers.append
+        for account in accounts:
+            db = account._db
+            ratio = ratios.get(db)
+            if ratio is None:
+                ratio = ratios[db] = db.load_monthly_interest_rate().as_integer_ratio()
+            append(account._pay_interest(*ratio))
+        return confirmation_numbers
+
+    def _pay_interest(self, rate_numerator, rate_denominator):
+        confirmation_number = self._new_confirmation(self._interest_deposit_type)
+
+        balance = self._balance
+        interest = _apply_rate(balance, rate_numerator, rate_denominator)
+        self._balance = balance + interest
+
+        confirmation_number._amount = interest
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Applied %s%% interest. New balance is %s", self.monthly_interest_rate * _HUNDRED,
+                         self.balance)
+        self._record_transaction(confirmation_number)
         return confirmation_number
 
     @classmethod
     def change_monthly_interest_rate(cls, interest, db):
-        if not cls.is_amount_a_number(interest):
+        try:
+            interest = _quantize_amount(interest)
+        except _INVALID_AMOUNT_ERRORS:
             raise ValueError("Invalid interest: interest must be a number or a string representing a number")
 
-        interest = Decimal(interest).quantize(Decimal('.01'))
-
         if interest < 0:
             raise ValueError("Invalid interest: interest must be a non-negative number")
 
-        if interest > Decimal('0.4'):
+        if interest > _MAX_RATE:
             raise ValueError("Invalid interest: interest must not exceed 40%")
 
         db.save_monthly_interest_rate(interest)
 
         cls.monthly_interest_rate = interest
-        print(f"Monthly interest rate updated to {cls.monthly_interest_rate}")
+        logger.info("Monthly interest rate updated to %s", interest)
 
     def withdraw(self, amount):
-        confirmation_number = ConfirmationNumber(transaction_type=self._withdrawal_type,
-                                                 account_number=self._account_number,
-                                                 transaction_time=datetime.now(tz=pytz.utc),
-                                                 transaction_id=self._db.load_transaction_id())
-        self._db.save_transaction_id(confirmation_number.transaction_id + 1)
+        confirmation_number = self._new_confirmation(self._withdrawal_type)
 
-        if not self.is_amount_a_number(amount):
+        try:
+            if type(amount) is int:
+                # A whole amount is checked in cents as it is, no Decimal is parsed for an amount that gets declined
+                cents = amount * 100
+            else:
+                cents = int(_quantize_amount(amount).scaleb(2))
+        except _INVALID_AMOUNT_ERRORS:
             self._transaction_failure(confirmation_number)
             raise TransactionDeclinedError("Invalid amount: amount must be a number or a string representing a number.")
 
-        amount = Decimal(amount).quantize(Decimal('.01'))
-
-        if amount <= 0:
-            self._transaction_failure(confirmation_number)
-            raise TransactionDeclinedError('Invalid amount: amount must be a positive number.')
-
-        if amount > self._balance:
+        balance = self._balance
+        if cents <= 0 or cents > balance:
             self._transaction_failure(confirmation_number)
+            if cents <= 0:
+                raise TransactionDeclinedError('Invalid amount: amount must be a positive number.')
             raise TransactionDeclinedError(
                 'Invalid amount: cannot withdraw an amount of money higher than the balance.')
 
-        confirmation_number.amount = amount
+        # Already in cents, so it's set directly instead of being converted again by the amount setter
+        confirmation_number._amount = cents
 
-        self._balance -= amount
-        print(f"Withdrew {amount}. New balance is {self._balance}")
-        self._transactions.append(confirmation_number)
-        self._db.add_transaction(confirmation_number)
+        self._balance = balance - cents
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Withdrew %s. New balance is %s", confirmation_number.amount, self.balance)
+        self._record_transaction(confirmation_number)
         return confirmation_number
 
     @staticmethod
     def is_amount_a_number(amount):
+        # An int that fits in the Decimal precision with its two decimal places is always a valid amount, everything
+        # else, Decimals and floats included, is checked by rounding it to the cent the way the operations do, so
+        # this agrees with them on values too large to be rounded
+        if type(amount) is int and -_MAX_EXACT_INT < amount < _MAX_EXACT_INT:
+            return True
         try:
-            Decimal(amount).quantize(Decimal('.01'))
+            _quantize_amount(amount)
             return True
-        except (InvalidOperation, TypeError, ValueError):
+        except _INVALID_AMOUNT_ERRORS:
             return False
 
+    def _new_confirmation(self, transaction_type):
+        # Every operation starts by numbering its transaction and stamping it with the current time
+        return ConfirmationNumber._from_cents(transaction_type, self._account_number, _now_us(),
+                                              self._db.next_transaction_id(), 0)
+
     def _transaction_failure(self, confirmation_number):
         confirmation_number._transaction_type = self._declined_transaction_type
-        self._transactions.append(confirmation_number)
+        self._record_transaction(confirmation_number)
+
+    def _clear_transactions(self):
+        # The account's transactions are kept column by column, one compact array per field, instead of as a list of
+        # ConfirmationNumber objects. Times are microseconds since the epoch and amounts are cents.
+        self._tx_ids = array('q')
+        self._tx_types = bytearray()
+        self._tx_times = array('q')
+        self._tx_amounts = array('q')
+        # Whether the times are in order, see transaction_indices
+        self._tx_in_order = True
+
+    def _append_transaction(self, confirmation_number):
+        # Runs for every transaction, so the fields are read straight from the slots instead of through the properties
+        times = self._tx_times
+        transaction_time = confirmation_number._transaction_time
+        if times and transaction_time < times[-1]:
+            self._tx_in_order = False
+        self._tx_ids.append(confirmation_number._transaction_id)
+        self._tx_types.append(ord(confirmation_number._transaction_type))
+        times.append(transaction_time)
+        self._tx_amounts.append(confirmation_number._amount)
+
+    def _record_transaction(self, confirmation_number):
+        self._append_transaction(confirmation_number)
         self._db.add_transaction(confirmation_number)
 
+    def view_confirmation(self, index):
+        # Build the ConfirmationNumber of the account's index-th transaction, only when it's actually needed
+        return ConfirmationNumber._from_cents(chr(self._tx_types[index]), self._account_number, self._tx_times[index],
+                                              self._tx_ids[index], self._tx_amounts[index])
+
+    def transaction_indices(self, transaction_type='All', time_range=7):
+        # The indices of the account's transactions of the given type in the last time_range days, newest first, the
+        # same filter get_transactions_by_type runs on the database. Pass them to view_confirmation.
+        if time_range not in TIME_RANGES:
+            raise ValueError('Invalid time range')
+        try:
+            wanted = _HISTORY_TYPES[transaction_type]
+        except KeyError:
+            raise ValueError("Invalid transaction_type")
+
+        end = _now_us()
+        start = end - time_range * _MICROSECONDS_PER_DAY
+        times = self._tx_times
+        if not self._tx_in_order:
+            # The times come from the wall clock, which can be set back. Once it has been, bisection could miss part of
+            # the window, so every transaction is checked instead, the last added first.
+            types = self._tx_types
+            return [i for i in range(len(times) - 1, -1, -1)
+                    if start <= times[i] <= end and (wanted is None or wanted[types[i]])]
+
+        # Transactions are appended as they happen, so the times are in order and the window is found by bisection
+        low = bisect_left(times, start)
+        high = bisect_right(times, end)
+
+        if wanted is None:
+            return list(range(high - 1, low - 1, -1))
+        # Translating the window's type codes through the mask gives a 1 for every match, and compress picks their
+        # indices, so the filtering runs in C instead of testing each transaction in a Python loop
+        indices = list(compress(range(low, high), self._tx_types[low:high].translate(wanted)))
+        indices.reverse()
+        return indices
+
+    def __setstate__(self, state):
+        # Accounts stored before the accounts table had columns were pickled with a __dict__, holding their
+        # transactions as a list of ConfirmationNumber objects and their own copy of the transaction type codes.
+        if isinstance(state, dict) and '_transactions' in state:
+            state = dict(state)
+            transactions = state.pop('_transactions')
+            self._clear_transactions()
+            for confirmation_number in transactions:
+                self._append_transaction(confirmation_number)
+            for name in ('_deposit_type', '_interest_deposit_type', '_withdrawal_type', '_declined_transaction_type'):
+                state.pop(name, None)
+            # and their balance as a Decimal amount instead of cents
+            state['_balance'] = int(Decimal(state['_balance']).scaleb(2))
+        _restore_slots(self, state)
+        if not hasattr(self, '_tx_in_order'):
+            # Pickled before the order of the times was tracked
+            times = self._tx_times
+            self._tx_in_order = all(earlier <= later for earlier, later in zip(times, times[1:]))
+
     def localize_confirmation_number(self, confirmation_number):
         confirmation_number._time_zone = self.time_zone
         return confirmation_number
@@ -244,6 +466,9 @@ class Account:
 
 
 class Customer:
+    __slots__ = ('_f_name', '_l_name', '_age', '_gender', '_mobile_number', '_address', '_email', '_national_number',
+                 '_fullname')
+
     def __init__(self, f_name, l_name, age, gender, mobile_number, address, email, national_number):
         self._f_name = f_name
         self._l_name = l_name
@@ -253,10 +478,12 @@ class Customer:
         self._address = address
         self._email = email
         self._national_number = national_number
+        # The names can't be changed, so the full name is built once here instead of on every access
+        self._fullname = f'{f_name} {l_name}'
 
     @property
     def fullname(self):
-        return f'{self._f_name} {self._l_name}'
+        return self._fullname
 
     def __repr__(self):
         return f"Customer('{self._f_name}', '{self._l_name}', {self._age}, '{self._gender}', '{self._mobile_number}'," \
@@ -265,7 +492,7 @@ class Customer:
     def __str__(self):
         return f'''Customer Information:
 -------------------
-Full Name: {self._f_name} {self._l_name}
+Full Name: {self._fullname}
 Age: {self._age}
 Gender: {self._gender}
 Mobile Number: {self._mobile_number}
@@ -274,6 +501,42 @@ Email: {self._email}
 National Number: {self._national_number}'''
 
 
+def _validate_int_age(age):
+    if age < 18:
+        raise ValueError("Age must be an integer greater than or equal to 18")
+
+
+def _validate_str_age(age):
+    if not age.isdigit():
+        raise ValueError("Age must be an integer or convertible to an integer")
+    _validate_int_age(int(age))
+
+
+def _age_type_error(age):
+    raise ValueError("Age must be an integer greater than or equal to 18")
+
+
+def _validate_int_mobile(mobile_number):
+    digits = str(mobile_number)
+    if len(digits) != 10 or digits[0] == '0':
+        raise ValueError("Mobile number as an integer must have 10 digits and the leftmost digit must not be zero")
+
+
+def _validate_str_mobile(mobile_number):
+    if not mobile_number.isdigit() or len(mobile_number) != 11 or mobile_number[0] != '0' or mobile_number[1] == '0':
+        raise ValueError(
+            "Mobile number as a string must have 11 digits and start with a zero followed by a non-zero digit")
+
+
+def _mobile_type_error(mobile_number):
+    raise ValueError("Mobile number must be either an integer or a string")
+
+
+# validate_input looks the validator up by the exact type of the value, any other type gets the type error
+_AGE_VALIDATORS = {int: _validate_int_age, str: _validate_str_age}
+_MOBILE_VALIDATORS = {int: _validate_int_mobile, str: _validate_str_mobile}
+
+
 class BankEmployee:
     def __init__(self, db: DataBase):
         self._db = db
@@ -301,32 +564,16 @@ class BankEmployee:
             raise ValueError("National number must be a 14-digit string")
 
         if not is_new_account:
-            if isinstance(age, str):
-                if not age.isdigit():
-                    raise ValueError("Age must be an integer or convertible to an integer")
-                age = int(age)
-            if not isinstance(age, int) or age < 18:
-                raise ValueError("Age must be an integer greater than or equal to 18")
+            # The age and mobile number checks depend on the value's type, which picks the validator to run
+            _AGE_VALIDATORS.get(type(age), _age_type_error)(age)
             if gender not in ["Male", "Female", "Other"]:
                 raise ValueError("Gender must be one of 'Male', 'Female', 'Other'")
-            if isinstance(mobile_number, int):
-                if len(str(mobile_number)) != 10 or str(mobile_number)[0] == '0':
-                    raise ValueError(
-                        "Mobile number as an integer must have 10 digits and the leftmost digit must not be zero")
-            elif isinstance(mobile_number, str):
-                if not mobile_number.isdigit() or len(mobile_number) != 11 or mobile_number[0] != '0' \
-                        or mobile_number[1] == '0':
-                    raise ValueError(
-                        "Mobile number as a string must have 11 digits and start with a zero followed by"
-                        " a non-zero digit")
-            else:
-                raise ValueError("Mobile number must be either an integer or a string")
+            _MOBILE_VALIDATORS.get(type(mobile_number), _mobile_type_error)(mobile_number)
             if not isinstance(address, str) or not address:
                 raise ValueError("Address must be a non-empty string")
             if not isinstance(email, str) or not email:
                 raise ValueError("Email must be a non-empty string")
-            email_regex = re.compile(r"[^@]+@[^@]+\.[^@]+")
-            if not email_regex.match(email):
+            if not _EMAIL_RE.match(email):
                 raise ValueError("Email must be a valid email address")
 
     def register_new_account(self, f_name, l_name, national_number):
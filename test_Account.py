@@ -1,32 +1,60 @@
 import unittest
 from decimal import Decimal
 from datetime import datetime
-import pytz
-from main import Account, TransactionDeclinedError, AccountLimitExceededError, ConfirmationNumber, \
-    generate_account_number
-from database import DataBase
-from database_filename import get_database_filename
-from unittest.mock import MagicMock
-
-
-# class MockDataBase(DataBase):
-#     def __init__(self):
-#         super().__init__('mock.db')
-#         self.transaction_id = 0
-# 
-#     def load_transaction_id(self):
-#         return self.transaction_id
-# 
-#     def save_transaction_id(self, transaction_id):
-#         self.transaction_id = transaction_id
+from main import Account, TransactionDeclinedError, ConfirmationNumber, generate_account_number
+
+
+# The Decimal values the tests use more than once, parsed once when the module is loaded
+CENT = Decimal('.01')
+ZERO = Decimal('0.00')
+HUNDRED = Decimal('100.00')
+STARTING_BALANCE = Decimal('5000.00')
+RATE = Decimal('0.05')
+NEW_RATE = Decimal('0.06')
+
+# Valid amounts paired with the value they should be rounded to
+ROUNDED_AMOUNTS = tuple((amount, Decimal(amount).quantize(CENT))
+                        for amount in [100, 50.555, '60.98765', Decimal('40.333333333'), 0.01])
+# Amounts that are neither numbers nor strings of one, deposit and withdraw both decline them
+NOT_NUMBERS = ('not a number', '', None, {'a': 1}, {1, 2}, (1, 2), [1, 2])
+
+
+class FakeDB:
+    # Stands in for DataBase with just the methods Account calls, keeping what it's given in plain attributes for the
+    # tests to check. Much cheaper to set up for every test than a MagicMock spec'd on DataBase.
+    def __init__(self):
+        self.transaction_id = 0
+        self.added = []
+        # The rate the bank starts with, tests that need another one set it
+        self.monthly_interest_rate = RATE
+        self.saved_rates = []
+
+    def next_transaction_id(self):
+        transaction_id = self.transaction_id
+        self.transaction_id += 1
+        return transaction_id
+
+    def add_transaction(self, confirmation_number):
+        self.added.append(confirmation_number)
+
+    def load_monthly_interest_rate(self):
+        return self.monthly_interest_rate
+
+    def save_monthly_interest_rate(self, monthly_interest_rate):
+        self.saved_rates.append(monthly_interest_rate)
+        self.monthly_interest_rate = monthly_interest_rate
 
 
 class TestDeposit(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        # No test depends on the account number, so one is generated for the whole class
+        cls.account_number = generate_account_number()
+
     def setUp(self):
-        self.db = DataBase(get_database_filename())
-        self.mock_db = MagicMock(spec=DataBase)
-        self.account = Account(generate_account_number(), 5000.00, self.mock_db)
+        self.fake_db = FakeDB()
+        self.account = Account(self.account_number, 5000.00, self.fake_db)
 
     def test_deposit_returns_confirmation_number_object(self):
         # Act
@@ -47,7 +75,7 @@ class TestDeposit(unittest.TestCase):
 
     def test_amount_deposited_is_equal_to_amount_passed_as_argument(self):
         # Arrange
-        amount = Decimal('100.00')
+        amount = HUNDRED
 
         # Act
         result = self.account.deposit(amount)
@@ -63,87 +91,77 @@ class TestDeposit(unittest.TestCase):
         self.assertEqual(result.transaction_type, 'D')
 
     def test_transaction_declined_error_raised_if_amount_passed_is_not_number_or_string_representing_number(self):
-        # Act & Assert
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.deposit('not a number')
-
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.deposit('')
-
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.deposit(None)
-
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.deposit({'a': 1})
-
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.deposit({1, 2})
-
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.deposit((1, 2))
-
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.deposit([1, 2])
+        # Act & Assert, each value is reported on its own if it fails
+        for amount in NOT_NUMBERS:
+            with self.subTest(amount=amount), self.assertRaises(TransactionDeclinedError):
+                self.account.deposit(amount)
 
     def test_deposit_valid_amount_values_rounded_to_two_decimal_places(self):
-        # Define the valid deposit amounts to test
-        valid_amounts = [100, 50.555, '60.98765', Decimal('40.333333333'), 0, 0.01]
-
-        for amount in valid_amounts:
-            confirmation = self.account.deposit(amount)
+        # A deposit of zero is also valid
+        for amount, expected in ROUNDED_AMOUNTS + ((0, ZERO),):
+            with self.subTest(amount=amount):
+                # Every amount gets a fresh account, so one amount's result doesn't depend on the ones before it
+                account = Account(self.account_number, 5000.00, self.fake_db)
+                confirmation = account.deposit(amount)
 
-            # Check that the amount stored in the transaction is rounded to two decimal places
-            self.assertEqual(confirmation.amount, Decimal(amount).quantize(Decimal('.01')))
+                # Check that the amount stored in the transaction is rounded to two decimal places
+                self.assertEqual(confirmation.amount, expected)
 
     def test_transaction_is_correctly_saved_in_database(self):
         # Act
         cn = self.account.deposit(100.00)
 
         # Assert
-        self.mock_db.add_transaction.assert_called_with(cn)
+        self.assertIs(self.fake_db.added[-1], cn)
 
-    def test_deposit_increments_transaction_id_in_database(self):
-        # Get the initial transaction ID
-        self.mock_db.load_transaction_id.return_value = 100
+    def test_deposit_takes_transaction_id_from_database(self):
+        # Set the next transaction ID
+        self.fake_db.transaction_id = 100
 
         # Act
         cn = self.account.deposit(100.00)
 
-        self.assertEqual(self.mock_db.load_transaction_id.call_count, 1)
-        self.mock_db.save_transaction_id.assert_called_once_with(101)
+        self.assertEqual(self.fake_db.transaction_id, 101)
+        self.assertEqual(cn.transaction_id, 100)
 
         # Assert
-        self.mock_db.add_transaction.assert_called_once_with(cn)
+        self.assertEqual(self.fake_db.added, [cn])
 
     def test_deposit_transaction_type_is_X_when_TransactionDeclinedError_is_raised(self):
         # Arrange
-        self.mock_db.load_transaction_id.return_value = 5
+        self.fake_db.transaction_id = 5
 
         # Act & Assert
         with self.assertRaises(TransactionDeclinedError):
             self.account.deposit('not a number')
 
-        self.mock_db.load_transaction_id.assert_called_once()
-        self.mock_db.save_transaction_id.assert_called_once_with(6)
+        self.assertEqual(self.fake_db.transaction_id, 6)
 
-        # self.mock_db.add_transaction.assert_called_once_with(mock_confirmation_number)
-        args, kwargs = self.mock_db.add_transaction.call_args
-        transaction = args[0]
+        transaction = self.fake_db.added[-1]
 
         self.assertEqual(transaction.account_number, self.account.account_number)
         self.assertEqual(transaction.transaction_type, 'X')
         self.assertIsInstance(transaction.transaction_time, datetime)
         self.assertIsInstance(transaction.transaction_id, int)
-        self.assertEqual(transaction.amount, Decimal('0.00'))
+        self.assertEqual(transaction.amount, ZERO)
 
 
 class TestApplyInterest(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        # No test depends on the account number, so one is generated for the whole class
+        cls.account_number = generate_account_number()
+
     def setUp(self):
         # Create a test database and banking object for each test
-        self.mock_db = MagicMock(spec=DataBase)
-        self.account = Account(generate_account_number(), 5000.00, self.mock_db)
-        self.mock_db.load_monthly_interest_rate.return_value = Decimal('0.05')
+        self.fake_db = FakeDB()
+        self.account = Account(self.account_number, 5000.00, self.fake_db)
+
+        # The monthly interest rate is a class attribute, put it back after every test so a change doesn't leak into
+        # the tests that run after it
+        self.monthly_interest_rate = Account.monthly_interest_rate
+        self.addCleanup(setattr, Account, 'monthly_interest_rate', self.monthly_interest_rate)
 
     def test_apply_interest(self):
         # Arrange
@@ -174,99 +192,73 @@ class TestApplyInterest(unittest.TestCase):
         cn = self.account.apply_interest()
 
         # Assert
-        self.mock_db.add_transaction.assert_called_with(cn)
+        self.assertIs(self.fake_db.added[-1], cn)
 
-    def test_apply_interest_increments_transaction_id_in_database(self):
-        # Set the transaction ID return value
-        self.mock_db.load_transaction_id.return_value = 100
+    def test_apply_interest_takes_transaction_id_from_database(self):
+        # Set the next transaction ID
+        self.fake_db.transaction_id = 100
 
         # Act
         cn = self.account.apply_interest()
 
         # Assert
-        self.mock_db.add_transaction.assert_called_once_with(cn)
-        self.assertEqual(self.mock_db.load_transaction_id.call_count, 1)
-        self.mock_db.save_transaction_id.assert_called_once_with(101)
+        self.assertEqual(self.fake_db.added, [cn])
+        self.assertEqual(self.fake_db.transaction_id, 101)
+        self.assertEqual(cn.transaction_id, 100)
 
-    def test_apply_interest_does_not_change_balance_if_balance_is_zero(self):
-        # Arrange
-        acc = Account(generate_account_number(), 0, self.mock_db)
-
-        # Act
-        acc.apply_interest()
+    def test_apply_interest_does_not_change_balance_if_balance_or_interest_rate_is_zero(self):
+        for balance, rate in [(ZERO, RATE), (STARTING_BALANCE, ZERO)]:
+            with self.subTest(balance=balance, rate=rate):
+                # Arrange
+                self.fake_db.monthly_interest_rate = rate
+                account = Account(self.account_number, balance, self.fake_db)
 
-        # Assert, Verify that apply_interest does not change the balance if the balance is zero
-        self.assertEqual(acc.balance, Decimal('0.00'))
+                # Act
+                account.apply_interest()
 
-    def test_apply_interest_does_not_change_balance_if_interest_rate_is_zero(self):
-        # Arrange
-        self.mock_db.load_monthly_interest_rate.return_value = Decimal('0.00')
-
-        # Act
-        self.account.apply_interest()
-
-        # Assert, Verify that apply_interest does not change the balance if the interest rate is zero
-        self.assertEqual(self.account.balance, Decimal('5000.00'))
-
-        # Reset
-        self.mock_db.load_monthly_interest_rate.return_value = Decimal('0.05')
+                # Assert, Verify that apply_interest does not change the balance if either of them is zero
+                self.assertEqual(account.balance, balance)
 
     # --------------------------------------------------------
     def test_change_monthly_interest_rate_valid_input(self):
         # Act
-        self.account.change_monthly_interest_rate('0.06', self.mock_db)
+        self.account.change_monthly_interest_rate('0.06', self.fake_db)
 
         # Assert
-        self.assertEqual(self.account.__class__.monthly_interest_rate, Decimal('0.06'))
-        self.mock_db.save_monthly_interest_rate.assert_called_once_with(Decimal('0.06'))
+        self.assertEqual(self.account.__class__.monthly_interest_rate, NEW_RATE)
+        self.assertEqual(self.fake_db.saved_rates, [NEW_RATE])
 
     def test_change_monthly_interest_rate_valid_input_with_extra_zeros(self):
         # Act
-        self.account.change_monthly_interest_rate('0.06500', self.mock_db)
+        self.account.change_monthly_interest_rate('0.06500', self.fake_db)
 
         # Assert
-        self.assertEqual(self.account.__class__.monthly_interest_rate, Decimal('0.06'))
-        self.mock_db.save_monthly_interest_rate.assert_called_once_with(Decimal('0.06'))
+        self.assertEqual(self.account.__class__.monthly_interest_rate, NEW_RATE)
+        self.assertEqual(self.fake_db.saved_rates, [NEW_RATE])
 
     def test_change_monthly_interest_rate_invalid_interest_value(self):
-        # Act and Assert
-        with self.assertRaises(ValueError):
-            self.account.change_monthly_interest_rate('invalid_interest', self.mock_db)
-
-        with self.assertRaises(ValueError):
-            self.account.change_monthly_interest_rate('', self.mock_db)
-
-        with self.assertRaises(ValueError):
-            self.account.change_monthly_interest_rate(None, self.mock_db)
-
-        with self.assertRaises(ValueError):
-            self.account.change_monthly_interest_rate({'a': 1}, self.mock_db)
+        # Values that aren't numbers, a negative rate and one over the 40% maximum
+        for interest in ['invalid_interest', '', None, {'a': 1}, {1, 2}, (1, 2), [1, 2], '-0.01', '0.41']:
+            with self.subTest(interest=interest):
+                # Act and Assert
+                with self.assertRaises(ValueError):
+                    self.account.change_monthly_interest_rate(interest, self.fake_db)
 
-        with self.assertRaises(ValueError):
-            self.account.change_monthly_interest_rate({1, 2}, self.mock_db)
-
-        with self.assertRaises(ValueError):
-            self.account.change_monthly_interest_rate((1, 2), self.mock_db)
-
-        with self.assertRaises(ValueError):
-            self.account.change_monthly_interest_rate([1, 2], self.mock_db)
-
-    def test_change_monthly_interest_rate_invalid_input_negative_number(self):
-        # Act and Assert
-        with self.assertRaises(ValueError):
-            self.account.change_monthly_interest_rate('-0.01', self.mock_db)
-
-    def test_change_monthly_interest_rate_invalid_input_exceed_maximum(self):
-        # Act and Assert
-        with self.assertRaises(ValueError):
-            self.account.change_monthly_interest_rate('0.41', self.mock_db)
+                # Nothing was saved and the rate didn't change
+                self.assertEqual(self.fake_db.saved_rates, [])
+                self.assertEqual(Account.monthly_interest_rate, self.monthly_interest_rate)
 
 
 class TestWithdraw(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # No test depends on the account number, so one is generated for the whole class
+        cls.account_number = generate_account_number()
+
     def setUp(self):
         # Create a test database and account object for each test
-        self.mock_db = MagicMock(spec=DataBase)
-        self.account = Account(generate_account_number(), 5000.00, self.mock_db)
+        self.fake_db = FakeDB()
+        self.account = Account(self.account_number, 5000.00, self.fake_db)
 
     def test_withdraw_successfully(self):
         # Arrange
@@ -306,7 +298,7 @@ class TestWithdraw(unittest.TestCase):
 
     def test_amount_withdrew_is_equal_to_amount_passed_as_argument(self):
         # Arrange
-        amount = Decimal('100.00')
+        amount = HUNDRED
 
         # Act
         result = self.account.withdraw(amount)
@@ -322,37 +314,20 @@ class TestWithdraw(unittest.TestCase):
         self.assertEqual(result.transaction_type, 'W')
 
     def test_transaction_declined_error_raised_if_amount_passed_is_not_number_or_string_representing_number(self):
-        # Act & Assert
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.withdraw('not a number')
-
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.withdraw('')
-
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.withdraw(None)
-
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.withdraw({'a': 1})
-
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.withdraw({1, 2})
-
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.withdraw((1, 2))
-
-        with self.assertRaises(TransactionDeclinedError):
-            self.account.withdraw([1, 2])
+        # Act & Assert, each value is reported on its own if it fails
+        for amount in NOT_NUMBERS:
+            with self.subTest(amount=amount), self.assertRaises(TransactionDeclinedError):
+                self.account.withdraw(amount)
 
     def test_withdraw_valid_amount_values_rounded_to_two_decimal_places(self):
-        # Define the valid deposit amounts to test
-        valid_amounts = [100, 50.555, '60.98765', Decimal('40.333333333'), 0.01]
-
-        for amount in valid_amounts:
-            confirmation = self.account.withdraw(amount)
+        for amount, expected in ROUNDED_AMOUNTS:
+            with self.subTest(amount=amount):
+                # Every amount gets a fresh account, so one amount's result doesn't depend on the ones before it
+                account = Account(self.account_number, 5000.00, self.fake_db)
+                confirmation = account.withdraw(amount)
 
-            # Check that the amount stored in the transaction is rounded to two decimal places
-            self.assertEqual(confirmation.amount, Decimal(amount).quantize(Decimal('.01')))
+                # Check that the amount stored in the transaction is rounded to two decimal places
+                self.assertEqual(confirmation.amount, expected)
 
     def test_withdraw_zero_amount(self):
         # Act & Assert
@@ -364,62 +339,38 @@ class TestWithdraw(unittest.TestCase):
         cn = self.account.withdraw(100.00)
 
         # Assert
-        self.mock_db.add_transaction.assert_called_with(cn)
+        self.assertIs(self.fake_db.added[-1], cn)
 
-    def test_withdraw_increments_transaction_id_in_database(self):
+    def test_withdraw_takes_transaction_id_from_database(self):
         # Arrange
-        self.mock_db.load_transaction_id.return_value = 100
+        self.fake_db.transaction_id = 100
 
         # Act
         cn = self.account.withdraw(100.00)
 
         # Assert
-        self.mock_db.add_transaction.assert_called_once_with(cn)
-        self.assertEqual(self.mock_db.load_transaction_id.call_count, 1)
-        self.mock_db.save_transaction_id.assert_called_once_with(101)
+        self.assertEqual(self.fake_db.added, [cn])
+        self.assertEqual(self.fake_db.transaction_id, 101)
+        self.assertEqual(cn.transaction_id, 100)
 
     def test_withdraw_transaction_type_is_X_when_TransactionDeclinedError_is_raised(self):
-        # Arrange
-        self.mock_db.load_transaction_id.return_value = 27
-        test_values = ['not a number', -10, 0, 8000]
-
-        # Act & Assert
-        for test_value in test_values:
-            with self.assertRaises(TransactionDeclinedError):
-                self.account.withdraw(test_value)
-
-            # Check sent confirmation number details
-            args, kwargs = self.mock_db.add_transaction.call_args
-            transaction = args[0]
-
-            # Assert
-            self.mock_db.save_transaction_id.assert_called_with(28)
-            self.assertEqual(transaction.account_number, self.account.account_number)
-            self.assertEqual(transaction.transaction_type, 'X')
-            self.assertIsInstance(transaction.transaction_time, datetime)
-            self.assertIsInstance(transaction.transaction_id, int)
-            self.assertEqual(transaction.amount, Decimal('0.00'))
-
-        self.assertEqual(self.mock_db.load_transaction_id.call_count, 4)
-        self.assertEqual(self.mock_db.save_transaction_id.call_count, 4)
-
-    # def test_time_zones(self):
-    #     account_utc = Account("1234567890123456", 500, self.db)
-    #     account_local = Account("1234567890123457", 500, self.db, "US/Eastern")
-    #     account_utc.deposit(100)
-    #     account_local.deposit(100)
-    #     utc_time = datetime.now(tz=pytz.utc)
-    #     local_time = datetime.now(tz=pytz.timezone("US/Eastern"))
-    #     self.assertEqual(account_utc._transactions[0].transaction_time_utc, utc_time.isoformat())
-    #     self.assertEqual(account_local._transactions[0].transaction_time_utc, utc_time.isoformat())
-    #     self.assertEqual(account_utc._transactions[0].transaction_time_local,
-    #                      utc_time.strftime('%Y-%m-%d %H:%M:%S (UTC+0000)'))
-    #     self.assertEqual(account_local._transactions[0].transaction_time_local,
-    #                      local_time.strftime('%Y-%m-%d %H:%M:%S (EDT-0400)'))
-    #
-    # def test_account_limit_exceeded(self):
-    #     Account("1", 500, self.db)
-    #     Account("2", 500, self.db)
-    #     Account("3", 500, self.db)
-    #     with self.assertRaises(AccountLimitExceededError):
-    #         Account("4", 500, self.db)
+        for test_value in ['not a number', -10, 0, 8000]:
+            with self.subTest(amount=test_value):
+                # Arrange, every value gets its own database and account so it only sees its own transaction
+                fake_db = FakeDB()
+                fake_db.transaction_id = 27
+                account = Account(self.account_number, 5000.00, fake_db)
+
+                # Act
+                with self.assertRaises(TransactionDeclinedError):
+                    account.withdraw(test_value)
+
+                # Assert, check sent confirmation number details
+                [transaction] = fake_db.added
+                self.assertEqual(fake_db.transaction_id, 28)
+                self.assertEqual(transaction.transaction_id, 27)
+                self.assertEqual(transaction.account_number, account.account_number)
+                self.assertEqual(transaction.transaction_type, 'X')
+                self.assertIsInstance(transaction.transaction_time, datetime)
+                self.assertIsInstance(transaction.transaction_id, int)
+                self.assertEqual(transaction.amount, ZERO)
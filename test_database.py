@@ -0,0 +1,474 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+from database import DataBase, RejectedTransactionsError, transaction, to_epoch_us, _flush_databases
+from main import Account, ConfirmationNumber, generate_account_number
+
+
+CUSTOMER = ('Ahmed', 'Ali', 30, 'M', '01012345678', 'Cairo', 'ahmed@example.com', '29001011234567')
+OTHER_CUSTOMER = ('Mona', 'Hassan', 41, 'F', '01112345678', 'Giza', 'mona@example.com', '28201011234567')
+# A transaction time with microseconds, as the ISO text the transactions table used to store
+LEGACY_TIME = datetime(2023, 5, 1, 12, 34, 56, 123456, tzinfo=timezone.utc)
+
+
+class DataBaseTestCase(unittest.TestCase):
+    # Every test gets a DataBase on a fresh file in its own temporary directory, removed with the directory afterwards
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_file = os.path.join(directory.name, 'bank.db')
+        self.db = self.open_db()
+
+    def open_db(self, **kwargs):
+        db = DataBase(self.db_file, **kwargs)
+        self.addCleanup(db.close)
+        return db
+
+    def count_rows(self, table):
+        # Counted on a connection of its own, so only what has been committed is seen
+        conn = sqlite3.connect(self.db_file)
+        try:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        finally:
+            conn.close()
+
+    def execute_script(self, script):
+        # Set up the file the way an older version of the program left it, before the DataBase opens it
+        conn = sqlite3.connect(self.db_file)
+        try:
+            conn.executescript(script)
+        finally:
+            conn.close()
+
+
+class TestTransaction(DataBaseTestCase):
+
+    def test_rollback_undoes_the_writes_made_in_the_block(self):
+        # Act
+        with self.assertRaises(RuntimeError):
+            with transaction(self.db) as conn:
+                conn.execute("INSERT INTO metadata (key, value) VALUES ('owner', 'test')")
+                self.db.add_customer(*CUSTOMER)
+                raise RuntimeError
+
+        # Assert
+        self.assertEqual(self.count_rows('metadata'), 0)
+        self.assertEqual(self.count_rows('customers'), 0)
+
+    def test_writes_are_committed_when_the_block_ends(self):
+        # Act
+        with transaction(self.db):
+            self.db.add_customer(*CUSTOMER)
+            self.assertEqual(self.count_rows('customers'), 0)
+
+        # Assert
+        self.assertEqual(self.count_rows('customers'), 1)
+
+    def test_customer_added_in_the_block_is_seen_in_it(self):
+        # Act
+        with transaction(self.db):
+            self.db.add_customer(*CUSTOMER)
+            self.db.add_customer(*CUSTOMER)
+            in_system, _ = self.db.is_customer_in_the_system(CUSTOMER[-1])
+
+        # Assert
+        self.assertTrue(in_system)
+        self.assertEqual(self.count_rows('customers'), 1)
+
+    def test_rollback_undoes_transactions_flushed_in_the_block(self):
+        # Arrange
+        db = self.open_db(batch_size=2)
+        account = Account(generate_account_number(), 100, db)
+
+        # Act
+        with self.assertRaises(RuntimeError):
+            with transaction(db):
+                for _ in range(3):
+                    account.deposit(1)
+                raise RuntimeError
+        db.flush()
+
+        # Assert
+        self.assertEqual(self.count_rows('transactions'), 0)
+
+    def test_transactions_buffered_before_the_block_survive_its_rollback(self):
+        # Arrange
+        account = Account(generate_account_number(), 100, self.db)
+        account.deposit(1)
+
+        # Act
+        with self.assertRaises(RuntimeError):
+            with transaction(self.db):
+                account.deposit(1)
+                raise RuntimeError
+        self.db.flush()
+
+        # Assert
+        self.assertEqual(self.count_rows('transactions'), 1)
+
+    def test_history_read_partly_in_the_block_does_not_keep_the_lock(self):
+        # Arrange
+        account = Account(generate_account_number(), 100, self.db)
+        acquired = []
+
+        def take_lock():
+            acquired.append(self.db._lock.acquire(timeout=1))
+            if acquired[0]:
+                self.db._lock.release()
+
+        # Act
+        with transaction(self.db):
+            for _ in range(3):
+                account.deposit(1)
+            history = self.db.get_transactions_by_type(int(account.account_number))
+            first = next(history)
+        thread = threading.Thread(target=take_lock)
+        thread.start()
+        thread.join()
+
+        # Assert
+        self.assertEqual(first.account_number, account.account_number)
+        self.assertEqual(acquired, [True])
+        self.assertEqual(len(list(history)), 2)
+
+    def test_nested_block_is_rolled_back_on_its_own(self):
+        # Act
+        with transaction(self.db):
+            self.db.add_customer(*CUSTOMER)
+            with self.assertRaises(RuntimeError):
+                with transaction(self.db):
+                    self.db.save_monthly_interest_rate('0.06')
+                    raise RuntimeError
+
+        # Assert
+        self.assertEqual(self.count_rows('customers'), 1)
+        self.assertEqual(self.count_rows('metadata'), 0)
+
+
+class TestTransactionBatching(DataBaseTestCase):
+
+    def test_transactions_are_written_once_the_batch_is_full(self):
+        # Arrange
+        db = self.open_db(batch_size=3, flush_interval=60)
+        account = Account(generate_account_number(), 100, db)
+
+        # Act
+        account.deposit(1)
+        account.deposit(1)
+        buffered = self.count_rows('transactions')
+        account.deposit(1)
+
+        # Assert
+        self.assertEqual(buffered, 0)
+        self.assertEqual(self.count_rows('transactions'), 3)
+
+    def test_flush_writes_the_buffered_transactions(self):
+        # Arrange
+        db = self.open_db(flush_interval=60)
+        account = Account(generate_account_number(), 100, db)
+        account.deposit(1)
+
+        # Act
+        db.flush()
+
+        # Assert
+        self.assertEqual(self.count_rows('transactions'), 1)
+
+    def test_buffered_transactions_are_written_after_flush_interval(self):
+        # Arrange
+        db = self.open_db(flush_interval=0.05)
+        account = Account(generate_account_number(), 100, db)
+
+        # Act
+        account.deposit(1)
+        deadline = time.monotonic() + 5
+        while self.count_rows('transactions') == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # Assert
+        self.assertEqual(self.count_rows('transactions'), 1)
+
+    def test_reading_the_history_writes_the_buffered_transactions_first(self):
+        # Arrange
+        db = self.open_db(flush_interval=60)
+        account = Account(generate_account_number(), 100, db)
+        confirmation_number = account.deposit(1)
+
+        # Act
+        history = list(db.get_transactions_by_type(int(account.account_number)))
+
+        # Assert
+        self.assertEqual([cn.transaction_id for cn in history], [confirmation_number.transaction_id])
+        self.assertEqual(history[0].transaction_time_us, confirmation_number.transaction_time_us)
+        self.assertEqual(history[0].amount, confirmation_number.amount)
+
+    def test_databases_on_the_same_file_never_hand_out_the_same_id(self):
+        # Arrange
+        first = self.open_db(batch_size=2)
+        second = self.open_db(batch_size=2)
+
+        # Act
+        ids = [db.next_transaction_id() for _ in range(5) for db in (first, second)]
+
+        # Assert
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_close_gives_back_the_unused_ids(self):
+        # Arrange
+        db = self.open_db(batch_size=10)
+        db.next_transaction_id()
+
+        # Act
+        db.close()
+
+        # Assert
+        self.assertEqual(self.open_db().load_transaction_id(), 1)
+
+    def test_rejected_rows_are_dropped_and_later_writes_succeed(self):
+        # Arrange
+        account_number = generate_account_number()
+        self.db.add_transactions([ConfirmationNumber('D', account_number, LEGACY_TIME, 0, 1)])
+        self.db.add_transaction(ConfirmationNumber('D', account_number, LEGACY_TIME, 0, 1))
+        self.db.add_transaction(ConfirmationNumber('D', account_number, LEGACY_TIME, 1, 1))
+
+        # Act
+        with self.assertRaises(RejectedTransactionsError) as raised:
+            self.db.flush()
+        self.db.add_transaction(ConfirmationNumber('D', account_number, LEGACY_TIME, 2, 1))
+        self.db.flush()
+
+        # Assert
+        self.assertEqual(raised.exception.transaction_ids, [0])
+        self.assertEqual(self.count_rows('transactions'), 3)
+
+    def test_rows_dropped_by_the_timer_are_reported_by_the_next_flush(self):
+        # Arrange
+        db = self.open_db(flush_interval=0.05)
+        account_number = generate_account_number()
+        db.add_transactions([ConfirmationNumber('D', account_number, LEGACY_TIME, 0, 1)])
+
+        # Act
+        with self.assertLogs('database', level='ERROR'):
+            db.add_transaction(ConfirmationNumber('D', account_number, LEGACY_TIME, 0, 1))
+            deadline = time.monotonic() + 5
+            while db._timed_flush_error is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+        with self.assertRaises(RejectedTransactionsError) as raised:
+            db.flush()
+        db.flush()
+
+        # Assert
+        self.assertEqual(raised.exception.transaction_ids, [0])
+
+    def test_a_database_failing_at_exit_does_not_stop_the_others(self):
+        # Arrange
+        account_number = generate_account_number()
+        self.db.add_transactions([ConfirmationNumber('D', account_number, LEGACY_TIME, 0, 1)])
+        self.db.add_transaction(ConfirmationNumber('D', account_number, LEGACY_TIME, 0, 1))
+        other = self.open_db()
+        other.add_transaction(ConfirmationNumber('D', account_number, LEGACY_TIME, 1, 1))
+
+        # Act
+        with self.assertLogs('database', level='ERROR'):
+            _flush_databases()
+
+        # Assert
+        self.assertEqual(self.count_rows('transactions'), 2)
+
+
+class TestConnectionPool(DataBaseTestCase):
+
+    def test_relative_path_keeps_reading_the_same_file_after_chdir(self):
+        # Arrange
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(os.path.dirname(self.db_file))
+        db = DataBase(os.path.basename(self.db_file))
+        self.addCleanup(db.close)
+        # Written without reading, so no pooled connection is opened before the working directory changes
+        db.add_customers([CUSTOMER])
+
+        # Act
+        os.chdir(tempfile.gettempdir())
+        in_system, _ = db.is_customer_in_the_system(CUSTOMER[-1])
+
+        # Assert
+        self.assertTrue(in_system)
+
+
+class TestCustomersAndAccounts(DataBaseTestCase):
+
+    def test_add_customers_skips_customers_already_in_the_system(self):
+        # Arrange
+        self.db.add_customer(*CUSTOMER)
+
+        # Act
+        self.db.add_customers([CUSTOMER, OTHER_CUSTOMER, OTHER_CUSTOMER])
+
+        # Assert
+        self.assertEqual(self.count_rows('customers'), 2)
+
+    def test_add_accounts_stores_every_account(self):
+        # Arrange
+        accounts = [Account(generate_account_number(), balance, self.db) for balance in ('10.50', 20)]
+
+        # Act
+        self.db.add_accounts((account, 1) for account in accounts)
+
+        # Assert
+        for account in accounts:
+            with self.subTest(account=account.account_number):
+                stored = self.db.get_account(account.account_number)
+                self.assertEqual(stored.balance, account.balance)
+                self.assertEqual(stored.time_zone, account.time_zone)
+
+    def test_get_account_returns_none_for_a_missing_account(self):
+        self.assertIsNone(self.db.get_account(generate_account_number()))
+
+
+class TestMigrations(DataBaseTestCase):
+
+    def test_pickled_accounts_are_converted_when_read(self):
+        # Arrange
+        account_number = generate_account_number()
+        legacy_account = Account(account_number, '12.34', None, 'Europe/London')
+        self.execute_script("CREATE TABLE accounts (id INTEGER PRIMARY KEY, account_object BLOB, "
+                            "customer_id INTEGER NOT NULL)")
+        conn = sqlite3.connect(self.db_file)
+        with conn:
+            conn.execute("INSERT INTO accounts (id, account_object, customer_id) VALUES (?, ?, 1)",
+                         (int(account_number), pickle.dumps(legacy_account)))
+        conn.close()
+
+        # Act
+        account = self.open_db().get_account(account_number)
+
+        # Assert
+        self.assertEqual(account.balance, Decimal('12.34'))
+        self.assertEqual(account.time_zone, ZoneInfo('Europe/London'))
+        conn = sqlite3.connect(self.db_file)
+        row = conn.execute("SELECT balance, legacy_blob FROM accounts").fetchone()
+        conn.close()
+        self.assertEqual(row, (1234, None))
+
+    def test_legacy_transactions_table_is_rebuilt_with_exact_times(self):
+        # Arrange
+        self.execute_script(f"""CREATE TABLE transactions (id INTEGER PRIMARY KEY, account_number TEXT, type TEXT,
+                                                            created_at TIMESTAMP, amount INTEGER);
+                                INSERT INTO transactions VALUES (7, '0000000000001234', 'D',
+                                                                 '{LEGACY_TIME.isoformat()}', 150);""")
+
+        # Act, the connection is opened and the tables migrated on first use
+        self.open_db()._get_conn()
+
+        # Assert
+        conn = sqlite3.connect(self.db_file)
+        row = conn.execute("SELECT id, account_number, type, created_at, amount FROM transactions").fetchone()
+        conn.close()
+        self.assertEqual(row, (7, 1234, 'D', to_epoch_us(LEGACY_TIME), 150))
+
+    def test_rows_stranded_by_an_interrupted_rebuild_are_recovered(self):
+        # Arrange
+        self.execute_script(f"""CREATE TABLE transactions_legacy (id INTEGER PRIMARY KEY, account_number TEXT,
+                                                                   type TEXT, created_at TIMESTAMP, amount INTEGER);
+                                INSERT INTO transactions_legacy VALUES (7, '0000000000001234', 'D',
+                                                                        '{LEGACY_TIME.isoformat()}', 150);""")
+
+        # Act, the connection is opened and the tables migrated on first use
+        self.open_db()._get_conn()
+
+        # Assert
+        self.assertEqual(self.count_rows('transactions'), 1)
+        conn = sqlite3.connect(self.db_file)
+        stranded = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'transactions_legacy'").fetchone()
+        conn.close()
+        self.assertIsNone(stranded)
+
+
+class TestAccountHistory(DataBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.account = Account(generate_account_number(), 100, self.db)
+
+    def test_transaction_indices_newest_first_by_type(self):
+        # Arrange
+        self.account.deposit(10)
+        self.account.withdraw(5)
+        self.account.deposit(1)
+
+        # Act
+        all_indices = self.account.transaction_indices('All')
+        in_indices = self.account.transaction_indices('In')
+
+        # Assert
+        self.assertEqual(all_indices, [2, 1, 0])
+        self.assertEqual(in_indices, [2, 0])
+        self.assertEqual(self.account.view_confirmation(1).transaction_type, 'W')
+        self.assertEqual(self.account.view_confirmation(1).amount, Decimal('5.00'))
+
+    def test_transaction_indices_with_times_out_of_order(self):
+        # Arrange, the clock was set back between the transactions
+        now = datetime.now(tz=timezone.utc)
+        for transaction_id, moment in enumerate([now - timedelta(hours=1), now - timedelta(days=40),
+                                                 now - timedelta(hours=2)]):
+            self.account._append_transaction(
+                ConfirmationNumber('D', self.account.account_number, moment, transaction_id, 1))
+
+        # Act
+        indices = self.account.transaction_indices('All', 7)
+
+        # Assert
+        self.assertEqual(indices, [2, 0])
+
+    def test_apply_interest_batch_uses_the_database_rate(self):
+        # Arrange
+        accounts = [self.account, Account(generate_account_number(), 200, self.db)]
+
+        # Act
+        confirmation_numbers = Account.apply_interest_batch(accounts)
+        self.db.flush()
+
+        # Assert
+        self.assertEqual([cn.amount for cn in confirmation_numbers], [Decimal('5.00'), Decimal('10.00')])
+        self.assertEqual([account.balance for account in accounts], [Decimal('105.00'), Decimal('210.00')])
+        self.assertEqual(self.count_rows('transactions'), 2)
+
+
+class TestConfirmationNumber(unittest.TestCase):
+
+    def test_pickling_keeps_every_field(self):
+        # Arrange
+        confirmation_number = ConfirmationNumber('D', generate_account_number(), LEGACY_TIME, 3, '12.34')
+        confirmation_number._time_zone = ZoneInfo('Africa/Cairo')
+
+        # Act
+        copy = pickle.loads(pickle.dumps(confirmation_number))
+
+        # Assert
+        self.assertEqual(str(copy), str(confirmation_number))
+        self.assertEqual(copy.transaction_time_us, confirmation_number.transaction_time_us)
+        self.assertEqual(copy.amount_cents, 1234)
+        self.assertEqual(copy.transaction_time_local, confirmation_number.transaction_time_local)
+
+    def test_naive_transaction_time_is_taken_as_utc(self):
+        # Act
+        confirmation_number = ConfirmationNumber('D', generate_account_number(), LEGACY_TIME.replace(tzinfo=None), 3)
+
+        # Assert
+        self.assertEqual(confirmation_number.transaction_time, LEGACY_TIME)
+
+    def test_amounts_too_large_to_round_are_not_numbers(self):
+        self.assertFalse(Account.is_amount_a_number(1e30))
+        self.assertTrue(Account.is_amount_a_number(10 ** 20))
+
+
+if __name__ == '__main__':
+    unittest.main()
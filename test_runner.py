@@ -1,22 +1,12 @@
+import sys
 import unittest
-from test_Account import TestDeposit, TestApplyInterest, TestWithdraw
+import test_Account
+import test_database
 
 if __name__ == '__main__':
-    suite_deposit = unittest.TestSuite()
-    suite_deposit.addTest(unittest.makeSuite(TestDeposit))
-    runner = unittest.TextTestRunner()
-    runner.run(suite_deposit)
-
-    # ----------------------------------------------
-
-    suite_apply_interest = unittest.TestSuite()
-    suite_apply_interest.addTest(unittest.makeSuite(TestApplyInterest))
-    runner = unittest.TextTestRunner()
-    runner.run(suite_apply_interest)
-
-    # ----------------------------------------------
-
-    suite_withdraw = unittest.TestSuite()
-    suite_withdraw.addTest(unittest.makeSuite(TestWithdraw))
-    runner = unittest.TextTestRunner()
-    runner.run(suite_withdraw)
+    # Every test class in the test modules is collected in one pass, they run as one suite with a single runner and the
+    # exit code reports the result
+    loader = unittest.defaultTestLoader
+    suite = unittest.TestSuite(loader.loadTestsFromModule(module) for module in (test_Account, test_database))
+    result = unittest.TextTestRunner().run(suite)
+    sys.exit(not result.wasSuccessful())